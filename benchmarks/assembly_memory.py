@@ -0,0 +1,92 @@
+"""
+HTML Assembly Memory Benchmark
+
+Compares the memory the base64 + HTML assembly stage allocates on top of the
+rendered page images, for two ways of building a single-file flipbook:
+
+- legacy: main._b64_png per page, main._build_single_file_html, then encode
+          (data URL strings, a joined page list and one large f-string)
+- stream: main._page_parts per page written to a file, as /api/convert and
+          jobs send them (only the page being encoded is held)
+
+Pages are rendered once up front and not counted. Peak is measured with
+tracemalloc and reported as a multiple of the rendered image bytes.
+
+Usage:
+    python -m benchmarks.assembly_memory [--kind image] [--pages 50] [--repeat 3]
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+from benchmarks.synthetic import make_image_pdf, make_text_pdf, make_vector_pdf
+
+GENERATORS = {"text": make_text_pdf, "image": make_image_pdf, "vector": make_vector_pdf}
+PASSWORD = "benchmark"
+
+
+def legacy(main, images):
+    return len(main._build_single_file_html([main._b64_png(img) for img in images], PASSWORD).encode("utf-8"))
+
+
+def stream(main, images):
+    size = 0
+    with open(os.devnull, "wb") as sink:
+        size += sink.write(main.FLIPBOOK_HEAD)
+        for idx, img in enumerate(images):
+            parts = main._page_parts(idx, [img], main.RenderProfile().widths[:1], "image/png")
+            sink.writelines(parts)
+            size += sum(map(len, parts))
+        size += sink.write(main._flipbook_tail(PASSWORD))
+    return size
+
+
+PATHS = {"legacy": legacy, "stream": stream}
+
+
+def measure(fn, main, images, repeat: int):
+    """Best time and highest traced peak over repeat runs, plus the output size"""
+    best, peak, size = None, 0, 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = fn(main, images)
+        elapsed = time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", default="image", choices=sorted(GENERATORS))
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import main as app_main
+    from renderer import shutdown_render_pool
+
+    try:
+        images = app_main._render_pdf_to_images(GENERATORS[args.kind](args.pages))
+    finally:
+        shutdown_render_pool()
+    image_bytes = sum(len(img) for img in images)
+    print(f"{args.kind} x {args.pages} pages, {image_bytes / 1024 ** 2:.1f} MB of rendered images")
+    print(f"{'path':<7} {'ms':>9} {'peak MB':>9} {'x images':>9} {'output MB':>10}")
+
+    outputs = set()
+    for name, fn in PATHS.items():
+        seconds, peak, size = measure(fn, app_main, images, max(1, args.repeat))
+        outputs.add(size)
+        print(f"{name:<7} {seconds * 1000:>9.1f} {peak / 1024 ** 2:>9.1f} {peak / image_bytes:>9.2f} "
+              f"{size / 1024 ** 2:>10.1f}")
+    if len(outputs) != 1:
+        print("warning: the paths produced documents of different sizes")
+
+
+if __name__ == "__main__":
+    main()
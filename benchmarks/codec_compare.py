@@ -0,0 +1,73 @@
+"""
+Image Codec Benchmark
+
+Compares encode time and output bytes of PNG, JPEG and WebP (when Pillow
+with WebP is installed) across a corpus of PDFs. Without arguments the corpus
+is a synthetic text-heavy and a synthetic image-heavy document; pass PDF
+paths to benchmark real files instead.
+
+Usage:
+    python -m benchmarks.codec_compare [--pages 10] [--width 900] [file.pdf ...]
+"""
+
+import argparse
+import os
+import time
+
+import fitz  # PyMuPDF
+
+from benchmarks.synthetic import make_image_pdf, make_text_pdf
+from image_codecs import ImageCodec, encode_pixmap, webp_available
+
+
+def _codecs():
+    codecs = [ImageCodec("png"), ImageCodec("jpeg", 85), ImageCodec("jpeg", 60), ImageCodec("jpeg", 85, 80_000)]
+    if webp_available():
+        codecs += [ImageCodec("webp", 85), ImageCodec("webp", 60)]
+    return codecs
+
+
+def _label(codec: ImageCodec) -> str:
+    if codec.fmt == "png":
+        return "png"
+    budget = f" <= {codec.max_bytes // 1000}kB" if codec.max_bytes else ""
+    return f"{codec.fmt} q{codec.quality}{budget}"
+
+
+def bench_document(name: str, pdf_bytes: bytes, width: int):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pixmaps = []
+        for page in doc:
+            zoom = width / page.rect.width
+            pixmaps.append(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False))
+
+    print(f"\n{name}: {len(pixmaps)} pages at {width}px")
+    print(f"{'codec':<20} {'ms/page':>9} {'total kB':>10} {'vs png':>7}")
+    png_total = None
+    for codec in _codecs():
+        start = time.perf_counter()
+        total = sum(len(encode_pixmap(pix, codec)) for pix in pixmaps)
+        elapsed = time.perf_counter() - start
+        png_total = png_total or total
+        print(f"{_label(codec):<20} {elapsed * 1000 / len(pixmaps):>9.1f} {total / 1000:>10.0f} {total / png_total:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="PDF files to benchmark (default: synthetic corpus)")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic document")
+    parser.add_argument("--width", type=int, default=900)
+    args = parser.parse_args()
+
+    if args.files:
+        corpus = [(os.path.basename(path), open(path, "rb").read()) for path in args.files]
+    else:
+        corpus = [("text-heavy", make_text_pdf(args.pages)), ("image-heavy", make_image_pdf(args.pages))]
+    if not webp_available():
+        print("WebP skipped: Pillow with WebP support is not installed")
+    for name, pdf_bytes in corpus:
+        bench_document(name, pdf_bytes, args.width)
+
+
+if __name__ == "__main__":
+    main()
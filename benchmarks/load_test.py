@@ -0,0 +1,133 @@
+"""
+Load Test
+
+Drives POST /api/convert with concurrent clients against a local instance and
+reports throughput (conversions/s, pages/s, MB/s), latency percentiles and
+response statuses. 503s are conversions rejected by a full executor queue.
+
+Point it at a running server with --url, or pass --workers to start one with
+server.py first (several runs with different --workers compare single- and
+multi-process throughput). Started servers have their page caches disabled so
+every request does the full conversion.
+
+Usage:
+    python -m benchmarks.load_test [--url http://127.0.0.1:8000] [--workers N]
+                                   [--concurrency 8] [--requests 64] [--kind text] [--pages 10]
+"""
+
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+from benchmarks.pipeline import _multipart, percentile
+from benchmarks.startup import ROOT, _free_port, _wait_for_port
+from benchmarks.synthetic import make_image_pdf, make_text_pdf, make_vector_pdf
+
+GENERATORS = {"text": make_text_pdf, "image": make_image_pdf, "vector": make_vector_pdf}
+
+
+def _post(host: str, port: int, body: bytes, content_type: str) -> Tuple[int, int, float]:
+    """One conversion: (status, response bytes, seconds); status 0 for a connection error"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=600)
+    try:
+        conn.request("POST", "/api/convert", body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        size = len(response.read())
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status, size = 0, 0
+    finally:
+        conn.close()
+    return status, size, time.perf_counter() - start
+
+
+def run_load(host: str, port: int, body: bytes, content_type: str, concurrency: int, requests: int):
+    """Send requests conversions from concurrency client threads; returns per-request results and wall time"""
+    results: List[Tuple[int, int, float]] = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def client():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            result = _post(host, port, body, content_type)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def _start_server(workers: int) -> Tuple[subprocess.Popen, int]:
+    port = _free_port()
+    env = dict(os.environ, WEB_WORKERS=str(workers), PORT=str(port), HOST="127.0.0.1",
+               CONVERSION_CACHE_MAX_BYTES="0")
+    process = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env)
+    try:
+        _wait_for_port(port, process, timeout=180)
+    except Exception:
+        process.terminate()
+        raise
+    return process, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server to test (ignored with --workers)")
+    parser.add_argument("--workers", type=int, help="start server.py with this many workers and test it")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients sending at once")
+    parser.add_argument("--requests", type=int, default=64, help="conversions to send in total")
+    parser.add_argument("--kind", default="text", choices=sorted(GENERATORS))
+    parser.add_argument("--pages", type=int, default=10)
+    args = parser.parse_args()
+
+    body, content_type = _multipart({"password": "benchmark"}, f"{args.kind}.pdf", GENERATORS[args.kind](args.pages))
+    process: Optional[subprocess.Popen] = None
+    if args.workers:
+        process, port = _start_server(args.workers)
+        host = "127.0.0.1"
+        target = f"server.py with {args.workers} workers"
+    else:
+        url = urlparse(args.url)
+        host, port = url.hostname or "127.0.0.1", url.port or 80
+        target = args.url
+    try:
+        # One request first, so connection setup and lazy startup work are not measured
+        _post(host, port, body, content_type)
+        results, wall = run_load(host, port, body, content_type, max(1, args.concurrency), max(1, args.requests))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=180)
+
+    ok = [r for r in results if r[0] == 200]
+    statuses = Counter(r[0] for r in results)
+    print(f"{target}: {args.kind} x {args.pages} pages, {len(results)} requests, concurrency {args.concurrency}")
+    print(f"wall time     {wall:.2f} s")
+    print(f"throughput    {len(ok) / wall:.2f} conversions/s, {len(ok) * args.pages / wall:.1f} pages/s, "
+          f"{sum(r[1] for r in ok) / wall / 1024 ** 2:.1f} MB/s")
+    if ok:
+        latencies = [r[2] for r in ok]
+        print(f"latency       p50 {percentile(latencies, 50):.2f} s, p95 {percentile(latencies, 95):.2f} s, "
+              f"p99 {percentile(latencies, 99):.2f} s")
+    print("statuses      " + ", ".join(f"{status or 'error'}: {count}" for status, count in sorted(statuses.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Conversion Pipeline Benchmark
+
+Times each stage of the PDF -> flipbook pipeline on synthetic text-, image-
+and vector-heavy documents:
+
+- render:   main._render_pdf_to_images (PyMuPDF rasterisation + PNG encoding)
+- base64:   main._b64_png, once per rendered page
+- html:     main._build_single_file_html over the page data URLs
+- endpoint: POST /api/convert through an in-process ASGI driver (no server,
+            no network, no extra client dependency)
+
+Every stage reports p50/p99 latency, throughput, peak RSS (this process plus
+its render workers) and output bytes. The page and payload caches are disabled
+so repeated runs measure real work. Results are written as JSON; pass
+--compare with an earlier results file to print p50 changes per case.
+
+Usage:
+    python -m benchmarks.pipeline [--kinds text,image,vector] [--pages 1,10,100,500]
+                                  [--repeat 3] [--output results.json] [--compare old.json]
+"""
+
+import os
+
+# Measure work, not cache hits (must be set before main is imported)
+os.environ.setdefault("CONVERSION_CACHE_MAX_BYTES", "0")
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import make_image_pdf, make_text_pdf, make_vector_pdf
+
+GENERATORS = {"text": make_text_pdf, "image": make_image_pdf, "vector": make_vector_pdf}
+
+
+def _rss_bytes(pid: str = "self") -> int:
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _children(pid: int) -> List[str]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return f.read().split()
+    except OSError:
+        return []
+
+
+class RssSampler:
+    """Samples the resident set of this process and its children (render workers) in a thread.
+
+    Falls back to this process's lifetime peak (getrusage) where /proc is not available.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._proc = os.path.exists("/proc/self/statm")
+
+    def _sample(self) -> int:
+        total = _rss_bytes()
+        for child in _children(os.getpid()):
+            try:
+                total += _rss_bytes(child)
+            except OSError:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._sample())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if self._proc:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._proc:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, self._sample())
+        else:
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(1, round(pct / 100 * len(ordered) + 0.5))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Tuple[List[float], object, int]:
+    """Run fn repeat times; returns per-run seconds, the last result and the peak RSS"""
+    durations = []
+    result = None
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - start)
+    return durations, result, rss.peak
+
+
+def _multipart(fields: Dict[str, str], filename: str, pdf_bytes: bytes) -> Tuple[bytes, str]:
+    boundary = "flipbook-benchmark-boundary"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="pdf"; filename="{filename}"\r\n'
+        f"Content-Type: application/pdf\r\n\r\n".encode()
+        + pdf_bytes
+        + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def asgi_post(app, path: str, body: bytes, content_type: str, chunk_size: int = 64 * 1024) -> Tuple[int, bytes]:
+    """Drive one POST through an ASGI app in-process and return (status, response body)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    done = asyncio.Event()
+    status = 0
+    out = bytearray()
+
+    async def receive():
+        if chunks:
+            chunk = chunks.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+        # The client stays connected until the response has been sent
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            out.extend(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    return status, bytes(out)
+
+
+def _stage_result(stage: str, kind: str, pages: int, durations: List[float], peak_rss: int,
+                  output_bytes: int, work: float, unit: str) -> dict:
+    p50 = percentile(durations, 50)
+    return {
+        "kind": kind,
+        "pages": pages,
+        "stage": stage,
+        "runs": len(durations),
+        "p50_s": round(p50, 6),
+        "p99_s": round(percentile(durations, 99), 6),
+        "mean_s": round(sum(durations) / len(durations), 6),
+        "throughput": round(work / p50, 2) if p50 else None,
+        "throughput_unit": unit,
+        "peak_rss_mb": round(peak_rss / 1024 ** 2, 1),
+        "output_bytes": output_bytes,
+    }
+
+
+def bench_case(kind: str, pages: int, repeat: int, loop: asyncio.AbstractEventLoop) -> List[dict]:
+    import main
+
+    pdf_bytes = GENERATORS[kind](pages)
+    results = []
+
+    durations, images, rss = measure(lambda: main._render_pdf_to_images(pdf_bytes), repeat)
+    image_bytes = sum(len(img) for img in images)
+    results.append(_stage_result("render", kind, pages, durations, rss, image_bytes, pages, "pages/s"))
+
+    # One sample per page image, so p99 reflects the slowest pages
+    durations = []
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            for img in images:
+                start = time.perf_counter()
+                main._b64_png(img)
+                durations.append(time.perf_counter() - start)
+    data_urls = [main._b64_png(img) for img in images]
+    url_bytes = sum(len(url) for url in data_urls)
+    results.append(_stage_result(
+        "base64", kind, pages, durations, rss.peak, url_bytes, image_bytes / len(images) / 1024 ** 2, "MB/s"
+    ))
+
+    durations, html, rss = measure(lambda: main._build_single_file_html(data_urls, "benchmark"), repeat)
+    results.append(_stage_result("html", kind, pages, durations, rss, len(html), len(html) / 1024 ** 2, "MB/s"))
+
+    body, content_type = _multipart({"password": "benchmark"}, f"{kind}.pdf", pdf_bytes)
+
+    def convert():
+        status, response = loop.run_until_complete(asgi_post(main.app, "/api/convert", body, content_type))
+        if status != 200:
+            raise RuntimeError(f"/api/convert returned {status}: {response[:200]!r}")
+        return response
+
+    durations, response, rss = measure(convert, repeat)
+    results.append(_stage_result("endpoint", kind, pages, durations, rss, len(response), pages, "pages/s"))
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment() -> dict:
+    import fitz  # PyMuPDF
+
+    from renderer import RENDER_CHUNK_SIZE, RENDER_WORKERS
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "render_workers": RENDER_WORKERS,
+        "render_chunk_size": RENDER_CHUNK_SIZE,
+    }
+
+
+def _print_results(results: List[dict]):
+    print(f"{'kind':<7} {'pages':>5} {'stage':<9} {'p50 ms':>10} {'p99 ms':>10} {'throughput':>16} "
+          f"{'peak RSS':>9} {'output':>10}")
+    for r in results:
+        throughput = f"{r['throughput']} {r['throughput_unit']}" if r["throughput"] is not None else "-"
+        print(f"{r['kind']:<7} {r['pages']:>5} {r['stage']:<9} {r['p50_s'] * 1000:>10.2f} {r['p99_s'] * 1000:>10.2f} "
+              f"{throughput:>16} {r['peak_rss_mb']:>7.0f}MB {r['output_bytes'] / 1024:>8.0f}kB")
+
+
+def _print_comparison(results: List[dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["kind"], r["pages"], r["stage"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (p50, >1.00x means slower now)")
+    print(f"{'kind':<7} {'pages':>5} {'stage':<9} {'before ms':>10} {'now ms':>10} {'change':>8}")
+    for r in results:
+        old = baseline.get((r["kind"], r["pages"], r["stage"]))
+        if old is None or not old["p50_s"]:
+            continue
+        print(f"{r['kind']:<7} {r['pages']:>5} {r['stage']:<9} {old['p50_s'] * 1000:>10.2f} "
+              f"{r['p50_s'] * 1000:>10.2f} {r['p50_s'] / old['p50_s']:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", default="text,image,vector", help="comma-separated: text, image, vector")
+    parser.add_argument("--pages", default="1,10,100,500", help="comma-separated page counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage (p99 needs more runs to mean much)")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(GENERATORS)
+    if unknown:
+        parser.error(f"unknown kinds: {', '.join(sorted(unknown))}")
+    page_counts = [int(pages) for pages in args.pages.split(",") if pages.strip()]
+
+    from renderer import shutdown_render_pool
+
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        for kind in kinds:
+            for pages in page_counts:
+                print(f"{kind} x {pages} pages ...", file=sys.stderr)
+                results += bench_case(kind, pages, max(1, args.repeat), loop)
+    finally:
+        loop.close()
+        shutdown_render_pool()
+
+    report = {"environment": _environment(), "repeat": args.repeat, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    _print_results(results)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        _print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
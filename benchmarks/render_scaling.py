@@ -0,0 +1,47 @@
+"""
+Render Scaling Benchmark
+
+Measures pages/second of renderer.render_pdf_pages on a synthetic PDF for
+1..N worker processes.
+
+Usage:
+    python -m benchmarks.render_scaling [--pages 120] [--max-workers N] [--chunk-size 8]
+"""
+
+import argparse
+import os
+import time
+
+from benchmarks.synthetic import make_text_pdf
+from renderer import render_pdf_pages, shutdown_render_pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--width", type=int, default=900)
+    args = parser.parse_args()
+
+    pdf_bytes = make_text_pdf(args.pages)
+    print(f"{args.pages} pages, width={args.width}, chunk_size={args.chunk_size}")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        # Warm the pool so process start-up is not counted
+        render_pdf_pages(pdf_bytes, args.width, workers=workers, chunk_size=args.chunk_size)
+        start = time.perf_counter()
+        images = render_pdf_pages(pdf_bytes, args.width, workers=workers, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - start
+        assert len(images) == args.pages
+        rate = args.pages / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8} {elapsed:>9.2f} {rate:>9.1f} {rate / baseline:>7.2f}x")
+
+    shutdown_render_pool()
+
+
+if __name__ == "__main__":
+    main()
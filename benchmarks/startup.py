@@ -0,0 +1,113 @@
+"""
+Startup Benchmark
+
+Measures time to first request for each STARTUP_MODE: starts the app under
+uvicorn in a fresh process, waits for the port to accept connections, then
+sends one POST /api/convert and a second one for comparison.
+
+- port open:     process start until the port accepts a connection
+- first request: latency of the first conversion (pays any deferred startup work)
+- to first byte: process start until the first conversion has been answered
+- second:        latency of the next conversion, for a warmed-up baseline
+
+Page caches are disabled so both conversions do the same work. The document
+has more pages than RENDER_CHUNK_SIZE, so it is rendered on the worker pool.
+
+Usage:
+    python -m benchmarks.startup [--modes warm,lazy] [--kind text] [--pages 24] [--repeat 3]
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.pipeline import _multipart
+from benchmarks.synthetic import make_image_pdf, make_text_pdf, make_vector_pdf
+
+GENERATORS = {"text": make_text_pdf, "image": make_image_pdf, "vector": make_vector_pdf}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"port {port} not open after {timeout}s")
+
+
+def _convert(port: int, body: bytes, content_type: str) -> float:
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    try:
+        conn.request("POST", "/api/convert", body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"/api/convert returned {response.status}: {data[:200]!r}")
+    return time.perf_counter() - start
+
+
+def run_once(mode: str, body: bytes, content_type: str, timeout: float) -> Dict[str, float]:
+    port = _free_port()
+    env = dict(os.environ, STARTUP_MODE=mode, CONVERSION_CACHE_MAX_BYTES="0")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        _wait_for_port(port, process, timeout)
+        port_open = time.perf_counter() - start
+        first = _convert(port, body, content_type)
+        first_byte = time.perf_counter() - start
+        second = _convert(port, body, content_type)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {"port_open": port_open, "first": first, "to_first": first_byte, "second": second}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="warm,lazy", help="comma-separated: warm, lazy")
+    parser.add_argument("--kind", default="text", choices=sorted(GENERATORS))
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=3, help="server starts per mode (medians are reported)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the port to open")
+    args = parser.parse_args()
+
+    body, content_type = _multipart({"password": "benchmark"}, f"{args.kind}.pdf", GENERATORS[args.kind](args.pages))
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    print(f"{args.kind} x {args.pages} pages, {args.repeat} starts per mode")
+    print(f"{'mode':<6} {'port open s':>12} {'first req s':>12} {'to first s':>11} {'second req s':>13}")
+    for mode in modes:
+        runs: List[Dict[str, float]] = [
+            run_once(mode, body, content_type, args.timeout) for _ in range(max(1, args.repeat))
+        ]
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(f"{mode:<6} {median['port_open']:>12.3f} {median['first']:>12.3f} {median['to_first']:>11.3f} "
+              f"{median['second']:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
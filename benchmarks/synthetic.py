@@ -0,0 +1,79 @@
+"""
+Synthetic PDF Generation
+
+Builds PDFs locally with PyMuPDF so the benchmarks need no sample files.
+"""
+
+import random
+
+import fitz  # PyMuPDF
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+    "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. "
+)
+
+
+def make_text_pdf(pages: int) -> bytes:
+    """A4 pages filled with body text and a coloured header band"""
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.draw_rect(fitz.Rect(0, 0, 595, 90), color=None, fill=(0.15, 0.3, 0.6))
+        page.insert_text((40, 60), f"Synthetic page {n + 1}", fontsize=28, color=(1, 1, 1))
+        page.insert_textbox(fitz.Rect(40, 120, 555, 800), LOREM * 12, fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _photo_pixmap(width: int, height: int, seed: int) -> "fitz.Pixmap":
+    """Smooth colour gradients with per-pixel noise, compressing roughly like a photo"""
+    rng = random.Random(seed)
+    noise = [rng.randrange(24) for _ in range(256)]
+    samples = bytearray(width * height * 3)
+    i = 0
+    for y in range(height):
+        for x in range(width):
+            n = noise[(x * 7 + y * 13) & 255]
+            samples[i] = (x * 255 // width + n) & 255
+            samples[i + 1] = (y * 255 // height + n) & 255
+            samples[i + 2] = ((x + y + seed * 40) * 255 // (width + height) + n) & 255
+            i += 3
+    return fitz.Pixmap(fitz.csRGB, width, height, bytes(samples), False)
+
+
+def make_image_pdf(pages: int) -> bytes:
+    """A4 pages covered by a full-bleed photographic image and a caption"""
+    photos = [_photo_pixmap(600, 800, seed) for seed in range(4)]
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(fitz.Rect(0, 0, 595, 842), pixmap=photos[n % len(photos)])
+        page.insert_text((40, 810), f"Photo page {n + 1}", fontsize=18, color=(1, 1, 1))
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def make_vector_pdf(pages: int) -> bytes:
+    """A4 pages of line art: a few hundred stroked curves and filled shapes each"""
+    rng = random.Random(7)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=595, height=842)
+        shape = page.new_shape()
+        for _ in range(300):
+            points = [fitz.Point(rng.uniform(20, 575), rng.uniform(20, 822)) for _ in range(4)]
+            shape.draw_bezier(*points)
+            shape.finish(color=(rng.random(), rng.random(), rng.random()), width=rng.uniform(0.3, 2))
+        for _ in range(40):
+            x, y = rng.uniform(20, 500), rng.uniform(20, 760)
+            shape.draw_rect(fitz.Rect(x, y, x + rng.uniform(10, 80), y + rng.uniform(10, 60)))
+            shape.finish(color=None, fill=(rng.random(), rng.random(), rng.random()), fill_opacity=0.5)
+        shape.commit()
+        page.insert_text((40, 40), f"Vector page {n + 1}", fontsize=18)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
@@ -0,0 +1,191 @@
+"""
+Response Compression
+
+Streaming gzip and brotli for flipbook responses. The encoding is negotiated
+from the request's Accept-Encoding header, and the body is compressed chunk by
+chunk as the pipeline produces it, so a compressed response starts and ends
+at the same time as an uncompressed one and never has to be held whole.
+
+Static prefixes (the flipbook shell's <head> with its CSS and scripts) are
+compressed once per encoding: each gzip response continues from a copy of the
+compressor state left after the prefix, so only per-flipbook bytes are
+compressed per request. Brotli compressor state cannot be copied, so brotli
+responses compress the prefix themselves.
+
+Brotli needs the optional `brotli` package; without it only gzip is offered.
+
+Configure with environment variables:
+- RESPONSE_COMPRESSION: encodings offered, in order of preference; empty
+  disables compression (default: br,gzip)
+- GZIP_LEVEL: zlib compression level 1-9 (default: 6)
+- BROTLI_QUALITY: brotli quality 0-11 (default: 4)
+"""
+
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from metrics import StageTimings
+
+RESPONSE_COMPRESSION = tuple(
+    encoding.strip().lower() for encoding in os.getenv("RESPONSE_COMPRESSION", "br,gzip").split(",") if encoding.strip()
+)
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
+
+SUPPORTED_ENCODINGS = ("br", "gzip")
+
+
+def brotli_available() -> bool:
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def offered_encodings() -> Tuple[str, ...]:
+    """Configured encodings this process can produce, most preferred first"""
+    return tuple(
+        encoding for encoding in RESPONSE_COMPRESSION
+        if encoding in SUPPORTED_ENCODINGS and (encoding != "br" or brotli_available())
+    )
+
+
+def negotiate_encoding(accept_encoding: Optional[str], offered: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    """Pick the content coding for a response from an Accept-Encoding header; None means identity.
+
+    The client's highest q-value wins; on a tie the server's preference order decides.
+    """
+    if offered is None:
+        offered = offered_encodings()
+    if not accept_encoding or not offered:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for encoding in offered:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class StreamCompressor:
+    """Incremental gzip or brotli compressor for one response body"""
+
+    def __init__(self, encoding: str, _state=None):
+        self.encoding = encoding
+        if _state is not None:
+            self._state = _state
+        elif encoding == "gzip":
+            # wbits 31: zlib deflate with a gzip header and trailer
+            self._state = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            import brotli
+
+            self._state = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            raise ValueError(f"Unsupported content coding: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        """Compressed bytes ready so far; may be empty while the compressor buffers input"""
+        if self.encoding == "gzip":
+            return self._state.compress(data)
+        return self._state.process(data)
+
+    def flush(self) -> bytes:
+        """Everything compressed so far, so the client can decode up to this point"""
+        if self.encoding == "gzip":
+            return self._state.flush(zlib.Z_SYNC_FLUSH)
+        return self._state.flush()
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._state.flush(zlib.Z_FINISH)
+        return self._state.finish()
+
+    @property
+    def copyable(self) -> bool:
+        return self.encoding == "gzip"
+
+    def copy(self) -> "StreamCompressor":
+        """An independent compressor continuing from this state (gzip only)"""
+        if not self.copyable:
+            raise ValueError(f"{self.encoding} compressor state cannot be copied")
+        return StreamCompressor(self.encoding, _state=self._state.copy())
+
+
+class CompressedPrefix:
+    """A static leading block of response bodies, compressed once per encoding"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._lock = threading.Lock()
+        # encoding -> (compressed prefix, compressor state after it)
+        self._compressed: Dict[str, Tuple[bytes, StreamCompressor]] = {}
+
+    def start(self, encoding: str) -> Tuple[bytes, StreamCompressor]:
+        """The compressed prefix and a compressor to continue the stream with"""
+        with self._lock:
+            cached = self._compressed.get(encoding)
+            if cached is None:
+                compressor = StreamCompressor(encoding)
+                cached = (compressor.compress(self.data) + compressor.flush(), compressor)
+                if not compressor.copyable:
+                    return cached
+                self._compressed[encoding] = cached
+            return cached[0], cached[1].copy()
+
+
+def compress_stream(
+    items: Iterable[bytes],
+    encoding: str,
+    prefix: Optional[CompressedPrefix] = None,
+    timings: Optional[StageTimings] = None,
+) -> Iterator[bytes]:
+    """Compress a body as it is produced, yielding only non-empty output.
+
+    When the first item is prefix.data, its cached compressed form is sent
+    instead of compressing it again. The prefix is flushed so the client can
+    start parsing; after it, output goes out as the compressor emits it.
+    timings, if given, collects the time and output bytes of the "compress" stage.
+    """
+    items = iter(items)
+    compressor = None
+    try:
+        for item in items:
+            start = time.perf_counter() if timings is not None else 0.0
+            if compressor is None:
+                if prefix is not None and item == prefix.data:
+                    out, compressor = prefix.start(encoding)
+                else:
+                    compressor = StreamCompressor(encoding)
+                    out = compressor.compress(item) + compressor.flush()
+            else:
+                out = compressor.compress(item)
+            if timings is not None:
+                timings.add("compress", time.perf_counter() - start, len(out))
+            if out:
+                yield out
+        if compressor is None:
+            compressor = StreamCompressor(encoding)
+        yield compressor.finish()
+    finally:
+        if hasattr(items, "close"):
+            items.close()
@@ -0,0 +1,432 @@
+"""
+Conversion Cache
+
+Content-addressed cache of rendered page images. Entries are keyed on the
+SHA-256 of the PDF bytes plus the render parameters (rendered widths and
+image codec), so re-uploading the same document skips PyMuPDF entirely and only
+pays for HTML assembly.
+
+Each entry is a directory of page files on local disk. The total size is
+bounded and the least recently used entries are evicted first. Optionally the
+most recently used entries are also kept in memory as page lists.
+
+The same class backs each cached pipeline stage (rendered page images, and
+the encoded page payloads built from them) under its own directory, the
+store of page assets served individually in split-output mode, and the
+per-page content fingerprints that incremental conversions compare against,
+and the parsed page metadata of recently seen documents.
+
+Several processes (server workers) may share a directory. An entry another
+process wrote is picked up the first time it is looked up, and the disk
+budget covers the entries of all of them: on each commit the directory is
+rescanned under a lock file and the least recently used entries (by entry
+directory mtime, touched on every use) are evicted. Readers hold a shared
+flock on the entry directory; eviction skips entries it cannot lock
+exclusively, renames the directory away and only then deletes it, so no
+process loses pages it is still streaming. Entries used in the last
+EVICTION_GRACE_SECONDS are kept too, which covers files handed out by path().
+
+Configure with environment variables:
+- CONVERSION_CACHE_DIR: cache directory (default: <tmp>/flipbook-cache)
+- CONVERSION_CACHE_MAX_BYTES: combined disk budget in bytes of the page image,
+  payload and document caches, 0 disables all three (default: 1 GiB). It is
+  split between them: half for page images, 7/16 for payloads, 1/16 for
+  document metadata
+- CONVERSION_CACHE_MEMORY_ENTRIES: entries kept in memory (default: 0)
+- PAYLOAD_CACHE_DIR: directory for the encoded page payload stage
+  (default: <CONVERSION_CACHE_DIR>-payloads)
+- ASSET_STORE_DIR / ASSET_STORE_MAX_BYTES: published page assets of
+  split-output flipbooks (default: <tmp>/flipbook-assets, 5 GiB)
+- MANIFEST_CACHE_DIR / MANIFEST_CACHE_MAX_BYTES: page fingerprints of past
+  conversions, compared against by incremental conversions; independent of
+  CONVERSION_CACHE_MAX_BYTES, so incremental conversions keep working with
+  the page cache disabled (default: <CONVERSION_CACHE_DIR>-manifests, 64 MiB)
+- DOCUMENT_CACHE_DIR: page count, sizes and fingerprints per document
+  (default: <CONVERSION_CACHE_DIR>-documents)
+
+All caches together stay within CONVERSION_CACHE_MAX_BYTES +
+ASSET_STORE_MAX_BYTES + MANIFEST_CACHE_MAX_BYTES (about 6.1 GiB by default).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction then only knows of this process's readers
+    fcntl = None
+
+CONVERSION_CACHE_DIR = os.getenv("CONVERSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "flipbook-cache"))
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", 1024 ** 3))
+CONVERSION_CACHE_MEMORY_ENTRIES = int(os.getenv("CONVERSION_CACHE_MEMORY_ENTRIES", 0))
+PAYLOAD_CACHE_DIR = os.getenv("PAYLOAD_CACHE_DIR", CONVERSION_CACHE_DIR + "-payloads")
+ASSET_STORE_DIR = os.getenv("ASSET_STORE_DIR", os.path.join(tempfile.gettempdir(), "flipbook-assets"))
+ASSET_STORE_MAX_BYTES = int(os.getenv("ASSET_STORE_MAX_BYTES", 5 * 1024 ** 3))
+MANIFEST_CACHE_DIR = os.getenv("MANIFEST_CACHE_DIR", CONVERSION_CACHE_DIR + "-manifests")
+MANIFEST_CACHE_MAX_BYTES = int(os.getenv("MANIFEST_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", CONVERSION_CACHE_DIR + "-documents")
+
+# Shares of CONVERSION_CACHE_MAX_BYTES
+PAGE_CACHE_MAX_BYTES = CONVERSION_CACHE_MAX_BYTES // 2
+PAYLOAD_CACHE_MAX_BYTES = CONVERSION_CACHE_MAX_BYTES * 7 // 16
+DOCUMENT_CACHE_MAX_BYTES = CONVERSION_CACHE_MAX_BYTES - PAGE_CACHE_MAX_BYTES - PAYLOAD_CACHE_MAX_BYTES
+
+_STAGING_MARKER = ".staging-"
+_EVICTED_MARKER = ".evicted-"
+_LOCK_FILE = ".lock"
+
+# Entries used more recently than this are not evicted
+EVICTION_GRACE_SECONDS = 10.0
+# A staging directory left this long without writes belongs to no live conversion
+STALE_STAGING_SECONDS = 3600.0
+
+
+def cache_key(pdf_sha256: str, *render_ids: str) -> str:
+    """Key for a rendered document: hex SHA-256 of the PDF plus render parameter ids.
+
+    The hash is taken by the caller (uploads are hashed while they stream in).
+    """
+    return "-".join((pdf_sha256,) + render_ids)
+
+
+def _lock_dir(path: str, exclusive: bool) -> Optional[int]:
+    """Open a directory and flock it without waiting; the fd (close it to unlock), or None if locked or gone"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+    return fd
+
+
+def _is_at(fd: int, path: str) -> bool:
+    """Whether the directory open as fd is still the one at path (not renamed away or replaced)"""
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except OSError:
+        return False
+
+
+def _abandoned(path: str, name: str) -> bool:
+    """Whether a staging directory's writer is gone: its process exited, or it stopped writing long ago"""
+    try:
+        if os.stat(path).st_mtime < time.time() - STALE_STAGING_SECONDS:
+            return True
+        pid = int(name.split(_STAGING_MARKER, 1)[1].split("-", 1)[0])
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        return False
+    return False
+
+
+class ConversionCache:
+    """Disk-backed LRU of rendered pages with an optional in-memory hot set"""
+
+    def __init__(
+        self,
+        root: str = CONVERSION_CACHE_DIR,
+        max_bytes: int = CONVERSION_CACHE_MAX_BYTES,
+        memory_entries: int = CONVERSION_CACHE_MEMORY_ENTRIES,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> size on disk, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._memory: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self._readers: Dict[str, int] = {}
+        self._bytes = 0
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load(self):
+        """Index the entries on disk (left by a previous process, or shared with others) and apply the budget"""
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if _EVICTED_MARKER in name or (_STAGING_MARKER in name and _abandoned(path, name)):
+                shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._evict()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _adopt(self, key: str) -> bool:
+        """Index an entry another process published since this one loaded (lock held)"""
+        if key.startswith(".") or _STAGING_MARKER in key or _EVICTED_MARKER in key or os.sep in key:
+            return False
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(self._entry_dir(key)))
+        except OSError:
+            return False
+        self._entries[key] = size
+        self._bytes += size
+        return True
+
+    def get(self, key: str) -> Optional[Iterator[bytes]]:
+        """Return an iterator over the cached pages of key, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return iter(self._memory[key])
+            if key not in self._entries and not self._adopt(key):
+                self.misses += 1
+                return None
+            self._readers[key] = self._readers.get(key, 0) + 1
+        directory = self._entry_dir(key)
+        # Held until the pages have been read: other processes do not evict a locked entry
+        fd = _lock_dir(directory, exclusive=False)
+        if fd is not None and not _is_at(fd, directory):
+            os.close(fd)
+            fd = None
+        with self._lock:
+            if fd is None:
+                # Being evicted, or already removed, by another process
+                self._release(key)
+                if not os.path.isdir(directory):
+                    self._forget(key)
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(directory)
+        except OSError:
+            pass
+        return self._read_pages(key, fd)
+
+    def count(self, key: str) -> Optional[int]:
+        """Number of items stored under key, or None when there is no entry"""
+        with self._lock:
+            if key not in self._entries and not (self.enabled and self._adopt(key)):
+                return None
+        try:
+            return len(os.listdir(self._entry_dir(key)))
+        except OSError:
+            return None
+
+    def path(self, key: str, index: int, fmt: str) -> Optional[str]:
+        """Filesystem path of one stored item, marking the entry as recently used"""
+        with self._lock:
+            if key not in self._entries and not (self.enabled and self._adopt(key)):
+                return None
+            self._entries.move_to_end(key)
+        try:
+            # Marks the entry used for every process; keeps it through the eviction grace period
+            os.utime(self._entry_dir(key))
+        except OSError:
+            pass
+        path = os.path.join(self._entry_dir(key), f"{index:05d}.{fmt}")
+        return path if os.path.isfile(path) else None
+
+    def _read_pages(self, key: str, fd: int) -> Iterator[bytes]:
+        directory = self._entry_dir(key)
+        keep = [] if self.memory_entries > 0 else None
+        try:
+            for name in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, name), "rb") as f:
+                    data = f.read()
+                if keep is not None:
+                    keep.append(data)
+                yield data
+        finally:
+            os.close(fd)
+            with self._lock:
+                self._release(key)
+        if keep is not None:
+            self._remember(key, keep)
+
+    def _release(self, key: str):
+        """Drop one reader of key (lock held)"""
+        self._readers[key] -= 1
+        if not self._readers[key]:
+            del self._readers[key]
+
+    def _remember(self, key: str, pages: List[bytes]):
+        with self._lock:
+            if key not in self._entries:
+                return
+            self._memory[key] = pages
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def store(
+        self, key: str, pages: Iterable[Union[bytes, List[bytes]]], fmt: str = "png"
+    ) -> Iterator[Union[bytes, List[bytes]]]:
+        """Pass pages through while writing them to the cache.
+
+        A page may be a list of byte chunks; it is written to one file without
+        joining the chunks, and read back from disk as a single bytes object.
+        The entry only becomes visible once every page has been written; if
+        the caller stops early the partial entry is discarded.
+        """
+        if not self.enabled:
+            yield from pages
+            return
+
+        # The pid tells other processes sharing the directory whether the writer is still alive
+        staging = self._entry_dir(f"{key}{_STAGING_MARKER}{os.getpid()}-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        keep = [] if self.memory_entries > 0 else None
+        size = 0
+        try:
+            for idx, data in enumerate(pages):
+                with open(os.path.join(staging, f"{idx:05d}.{fmt}"), "wb") as f:
+                    if isinstance(data, list):
+                        f.writelines(data)
+                        size += sum(map(len, data))
+                    else:
+                        f.write(data)
+                        size += len(data)
+                if keep is not None:
+                    keep.append(data)
+                yield data
+            committed = self._commit(key, staging, size)
+            staging = None
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+        if committed and keep is not None:
+            self._remember(key, keep)
+
+    def _commit(self, key: str, staging: str, size: int) -> bool:
+        """Publish a fully written entry; False if it was not kept"""
+        if size > self.max_bytes:
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+        with self._lock:
+            if key in self._entries:
+                # A concurrent conversion of the same document finished first
+                shutil.rmtree(staging, ignore_errors=True)
+                return True
+            try:
+                os.rename(staging, self._entry_dir(key))
+            except OSError:
+                # Another process published the same entry first
+                shutil.rmtree(staging, ignore_errors=True)
+                return self._adopt(key)
+            self._entries[key] = size
+            self._bytes += size
+            self._evict()
+            return key in self._entries
+
+    @contextmanager
+    def _budget_lock(self):
+        """Serialise budget enforcement with the other processes sharing the directory"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, _LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _scan(self) -> List[tuple]:
+        """Sync the index with the directory, whoever wrote or removed entries; (mtime, key) of each (lock held)"""
+        found = []
+        for entry in os.scandir(self.root):
+            name = entry.name
+            if name.startswith(".") or _STAGING_MARKER in name or _EVICTED_MARKER in name:
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if name in self._entries or self._adopt(name):
+                found.append((mtime, name))
+        present = {name for _, name in found}
+        for key in list(self._entries):
+            if key not in present:
+                self._forget(key)
+        return found
+
+    def _evict(self):
+        """Drop least recently used entries until the disk budget, shared by every process, is met (lock held)"""
+        with self._budget_lock():
+            found = self._scan()
+            if self._bytes <= self.max_bytes:
+                return
+            recent = time.time() - EVICTION_GRACE_SECONDS
+            for mtime, key in sorted(found):
+                if self._bytes <= self.max_bytes or mtime > recent:
+                    break
+                if key not in self._readers and self._remove(key):
+                    self.evictions += 1
+
+    def _remove(self, key: str) -> bool:
+        """Delete an entry no process is reading: lock it, rename it away, then delete it (lock held)"""
+        directory = self._entry_dir(key)
+        fd = _lock_dir(directory, exclusive=True)
+        if fd is None:
+            if not os.path.isdir(directory):
+                self._forget(key)
+            return False
+        doomed = f"{directory}{_EVICTED_MARKER}{uuid.uuid4().hex}"
+        try:
+            # Readers that opened the directory before this see it moved and treat it as a miss
+            os.rename(directory, doomed)
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+        self._forget(key)
+        shutil.rmtree(doomed, ignore_errors=True)
+        return True
+
+    def _forget(self, key: str):
+        """Drop key from the index (lock held)"""
+        self._bytes -= self._entries.pop(key, 0)
+        self._memory.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                if key not in self._readers:
+                    self._remove(key)
+            self._memory.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "memory_entries": len(self._memory),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
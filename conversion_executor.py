@@ -0,0 +1,116 @@
+"""
+Conversion Executor
+
+Runs the CPU-bound parts of a conversion (rendering, encoding, HTML assembly)
+on a bounded thread pool, either as one call or step by step through an
+iterator, so the asyncio event loop stays free for other requests. At most
+CONVERT_CONCURRENCY conversions run at once and at most CONVERT_QUEUE_DEPTH
+more may wait; anything beyond that is rejected immediately with
+ConversionQueueFull so callers can answer 503.
+
+Configure with environment variables:
+- CONVERT_CONCURRENCY: conversions running at the same time (default: 2)
+- CONVERT_QUEUE_DEPTH: conversions allowed to wait for a slot (default: 8)
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator
+
+CONVERT_CONCURRENCY = max(1, int(os.getenv("CONVERT_CONCURRENCY", 2)))
+CONVERT_QUEUE_DEPTH = max(0, int(os.getenv("CONVERT_QUEUE_DEPTH", 8)))
+
+_EXHAUSTED = object()
+
+
+class ConversionQueueFull(Exception):
+    """Raised when every slot and queue position is taken"""
+
+
+class ConversionExecutor:
+    """Bounded executor for blocking conversion work, used from async routes"""
+
+    def __init__(self, concurrency: int = CONVERT_CONCURRENCY, queue_depth: int = CONVERT_QUEUE_DEPTH):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="convert")
+        # Running + waiting conversions; only touched from the event loop thread
+        self._pending = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def running(self) -> int:
+        return min(self._pending, self.concurrency)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._pending - self.concurrency)
+
+    def _admit(self):
+        if self._pending >= self.concurrency + self.queue_depth:
+            raise ConversionQueueFull(
+                f"{self._pending} conversions pending (limit {self.concurrency} running + {self.queue_depth} queued)"
+            )
+        self._pending += 1
+
+    async def _acquire(self):
+        """Take a queue position, then wait for a running slot"""
+        self._admit()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            self._pending -= 1
+            raise
+
+    def _release(self):
+        self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool, or raise ConversionQueueFull"""
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        # Release the slot when the work really finishes, not when the awaiting
+        # request goes away, so abandoned conversions still count against the limit
+        future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    async def stream(self, items: Iterator) -> AsyncIterator:
+        """Advance a blocking iterator on the pool, yielding each item.
+
+        One slot is held for the whole iteration. Raises ConversionQueueFull on
+        the first step when no queue position is free. When the consumer stops
+        early, the iterator is closed on the pool once its current step ends.
+        """
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        step = None
+        try:
+            while True:
+                step = self._executor.submit(next, items, _EXHAUSTED)
+                item = await asyncio.wrap_future(step)
+                if item is _EXHAUSTED:
+                    break
+                yield item
+        finally:
+            def close(_=None):
+                try:
+                    if hasattr(items, "close"):
+                        items.close()
+                finally:
+                    loop.call_soon_threadsafe(self._release)
+
+            if step is not None and not step.done():
+                step.add_done_callback(close)
+            else:
+                self._executor.submit(close)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
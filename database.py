@@ -3,53 +3,644 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+
+The client is created on first use, not at import, with an explicit
+connection pool and timeouts. Each helper has an `_async` twin for `async def`
+routes; it runs the blocking call on a small thread pool so the event loop
+never waits on MongoDB. `db` is still importable (`from database import db`)
+and is None when the database is not configured.
+
+For large collections, create_documents inserts in batches and
+iter_documents streams results page by page (keyset pagination), so neither
+holds more than one batch in memory. find_document and document_exists fetch
+at most one document.
+
+Reads can be served from an in-process result cache (see query_cache.py);
+the write helpers here invalidate it per collection.
+
+Indexes are declared in schemas.py, next to the data: a model lists its
+indexes in `__indexes__`, and COLLECTION_INDEXES covers collections used
+without a model. ensure_schema_indexes() creates them when the app starts.
+
+To run against a local mongod, set DATABASE_URL and DATABASE_NAME. To use an
+in-memory stand-in such as mongomock, pass its client to configure().
+
+Configure with environment variables:
+- DATABASE_URL / DATABASE_NAME: connection string and database name
+- MONGO_MAX_POOL_SIZE: connections per client (default: 20); also the number
+  of threads serving the async helpers
+- MONGO_MIN_POOL_SIZE: connections kept open when idle (default: 0)
+- MONGO_SERVER_SELECTION_TIMEOUT_MS: how long an operation waits for a usable
+  server before failing (default: 5000)
+- MONGO_CONNECT_TIMEOUT_MS: TCP connect timeout (default: 5000)
+- MONGO_SOCKET_TIMEOUT_MS: per-read/write socket timeout (default: 30000)
+- MONGO_WAIT_QUEUE_TIMEOUT_MS: how long an operation waits for a free pool
+  connection (default: 5000)
+- MONGO_TIMEOUT_MS: overall per-operation deadline, unset for none
+- MONGO_BULK_BATCH_SIZE: documents per insert_many/bulk_write round trip in
+  create_documents and bulk_write_documents (default: 1000)
+- MONGO_READ_BATCH_SIZE: documents per page in iter_documents (default: 500)
+- MONGO_ENSURE_INDEXES: create the indexes declared in schemas.py at
+  startup, 0 to leave indexes alone (default: 1)
+- MONGO_EXPLAIN_QUERIES: dev-mode check that explains each new query shape
+  once and flags plans with a COLLSCAN stage; "warn" logs them, "raise"
+  raises CollectionScanError (default: off)
 """
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timezone
+import asyncio
+import bson
+import functools
+import logging
 import os
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from typing import Union
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
 from pydantic import BaseModel
 
+from query_cache import QueryCache
+
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
-db = None
-
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+MONGO_MAX_POOL_SIZE = max(1, int(os.getenv("MONGO_MAX_POOL_SIZE", 20)))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 0)) or None
+BULK_BATCH_SIZE = max(1, int(os.getenv("MONGO_BULK_BATCH_SIZE", 1000)))
+READ_BATCH_SIZE = max(1, int(os.getenv("MONGO_READ_BATCH_SIZE", 500)))
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
+# Dev-mode query plan check: "warn" logs, "raise" raises CollectionScanError
+MONGO_EXPLAIN_QUERIES = os.getenv("MONGO_EXPLAIN_QUERIES", "").strip().lower()
+if MONGO_EXPLAIN_QUERIES in ("", "0", "false", "off", "no"):
+    MONGO_EXPLAIN_QUERIES = ""
+elif MONGO_EXPLAIN_QUERIES != "raise":
+    MONGO_EXPLAIN_QUERIES = "warn"
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "1").strip().lower() not in ("0", "false", "off", "no")
+
+# A projection: field names to return, or a {field: 0/1} mapping
+Projection = Optional[Union[Sequence[str], Mapping[str, Any]]]
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache of get_documents / find_document results (off unless QUERY_CACHE_TTL_SECONDS is set)
+query_cache = QueryCache()
+
+_client: Optional[MongoClient] = None
+_db = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+# Query shapes whose plan has been checked (MONGO_EXPLAIN_QUERIES)
+_explained = set()
+_explain_lock = threading.Lock()
+
+
+def client_options() -> dict:
+    """MongoClient keyword arguments for the configured pool and timeouts"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+    if MONGO_TIMEOUT_MS:
+        options["timeoutMS"] = MONGO_TIMEOUT_MS
+    return options
+
+
+def is_configured() -> bool:
+    """True when a database is set up, without connecting to it"""
+    return _db is not None or bool(database_url and database_name)
+
+
+def get_db():
+    """The application database, creating the client on first use; None when not configured"""
+    global _client, _db
+    if _db is not None or not (database_url and database_name):
+        return _db
+    with _lock:
+        if _db is None:
+            _client = MongoClient(database_url, **client_options())
+            _db = _client[database_name]
+    return _db
+
+
+def connect():
+    """Create the client and make one round trip, so the pool holds a live connection before traffic arrives"""
+    db = _require_db()
+    db.command("ping")
+    return db
+
+
+def configure(client, name: str):
+    """Use the given client (a MongoClient, or a stand-in such as mongomock's) and database name"""
+    global _client, _db
+    with _lock:
+        _client = client
+        _db = client[name]
+
+
+def close_client():
+    """Close the connection pool; the next call creates a fresh client"""
+    global _client, _db
+    with _lock:
+        client, _client, _db = _client, None, None
+    if client is not None:
+        client.close()
+
+
+def __getattr__(name: str):
+    # `db` is resolved on access so importing this module does not create a client
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _require_db():
+    db = get_db()
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    return db
+
 
+def _to_dict(data: Union[BaseModel, dict], exclude_unset: bool = False) -> dict:
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
-    else:
-        data_dict = data.copy()
+        return data.model_dump(exclude_unset=exclude_unset)
+    return dict(data)
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+def _stamped(data: Union[BaseModel, dict], now: datetime) -> dict:
+    data_dict = _to_dict(data)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+    return data_dict
+
+
+# Helper functions for common database operations
+def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    db = _require_db()
+
+    data_dict = _stamped(data, datetime.now(timezone.utc))
+
+    with _writing(collection_name):
+        result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
+def create_documents(
+    collection_name: str,
+    items: Iterable[Union[BaseModel, dict]],
+    ordered: bool = True,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> List[str]:
+    """Insert many documents with timestamps, batch_size per round trip; returns the inserted ids.
+
+    items may be any iterable (a generator streams from the source without
+    holding it whole). Ordered inserts stop at the first failing document;
+    unordered ones insert everything they can and then raise one
+    BulkWriteError. Either way the error's writeErrors indexes and nInserted
+    count from the start of items, not from the failing batch.
+    """
+    db = _require_db()
+    collection = db[collection_name]
+    now = datetime.now(timezone.utc)
+    inserted: List[str] = []
+    errors = []
+    offset = 0
+    for batch in _batches(items, batch_size):
+        docs = [_stamped(item, now) for item in batch]
+        try:
+            with _writing(collection_name):
+                result = collection.insert_many(docs, ordered=ordered)
+            inserted.extend(str(_id) for _id in result.inserted_ids)
+        except BulkWriteError as exc:
+            if ordered:
+                raise _batch_error(exc, offset, len(inserted))
+            failed = {error["index"] for error in exc.details.get("writeErrors", [])}
+            inserted.extend(str(doc["_id"]) for idx, doc in enumerate(docs) if idx not in failed)
+            errors.extend(_batch_error(exc, offset, 0).details["writeErrors"])
+        offset += len(docs)
+    if errors:
+        raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+    return inserted
+
+def bulk_write_documents(
+    collection_name: str, operations: Iterable, ordered: bool = True, batch_size: int = BULK_BATCH_SIZE
+) -> dict:
+    """Run pymongo write operations (InsertOne, UpdateOne, DeleteMany, ...) batch_size per round trip.
+
+    Returns the summed counts: inserted, matched, modified, deleted, upserted.
+    Documents are written as given, without timestamps.
+    """
+    db = _require_db()
+    collection = db[collection_name]
+    totals = {"inserted": 0, "matched": 0, "modified": 0, "deleted": 0, "upserted": 0}
+    for batch in _batches(operations, batch_size):
+        with _writing(collection_name):
+            result = collection.bulk_write(batch, ordered=ordered)
+        totals["inserted"] += result.inserted_count
+        totals["matched"] += result.matched_count
+        totals["modified"] += result.modified_count
+        totals["deleted"] += result.deleted_count
+        totals["upserted"] += result.upserted_count
+    return totals
+
+def get_documents(
+    collection_name: str,
+    filter_dict: dict = None,
+    limit: int = None,
+    projection: Projection = None,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    cache: bool = True,
+):
+    """Get documents from collection (all at once; use iter_documents for large results).
+
+    Served from the query cache when it is enabled for the collection; pass
+    cache=False for a read that must see writes made outside this process.
+    """
+    db = _require_db()
+
+    def fetch():
+        _check_plan(collection_name, filter_dict, sort)
+        cursor = db[collection_name].find(filter_dict or {}, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        return list(cursor)
+
+    return _read_through(db, collection_name, ("many", filter_dict, limit, projection, sort), fetch, cache)
+
+def find_document(
+    collection_name: str,
+    filter_dict: dict,
+    projection: Projection = None,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    cache: bool = True,
+) -> Optional[dict]:
+    """Get the first document matching filter (in sort order if given), or None"""
+    db = _require_db()
+
+    def fetch():
+        _check_plan(collection_name, filter_dict, sort)
+        doc = db[collection_name].find_one(filter_dict, projection, sort=sort)
+        return [doc] if doc is not None else []
+
+    docs = _read_through(db, collection_name, ("one", filter_dict, projection, sort), fetch, cache)
+    return docs[0] if docs else None
+
+def document_exists(collection_name: str, filter_dict: dict, cache: bool = True) -> bool:
+    """Whether any document matches filter, fetching only its _id"""
+    return find_document(collection_name, filter_dict, {"_id": 1}, cache=cache) is not None
+
+def _read_through(db, collection_name: str, query: tuple, fetch: Callable[[], List[dict]], cache: bool) -> List[dict]:
+    if not (cache and query_cache.caches(collection_name)):
+        return fetch()
+    key = query_cache.key(collection_name, *query)
+    # Decode hits like the driver decodes results (tz_aware, document_class, ...)
+    codec_options = getattr(db, "codec_options", None)
+    if not isinstance(codec_options, bson.CodecOptions):
+        codec_options = bson.DEFAULT_CODEC_OPTIONS
+    docs = query_cache.get(key, codec_options)
+    if docs is None:
+        generation = query_cache.generation(collection_name)
+        docs = fetch()
+        query_cache.put(key, docs, generation)
+    return docs
+
+@contextmanager
+def _writing(collection_name: str):
+    """Invalidate the collection's cached reads once a write to it has finished (or failed)"""
+    try:
+        yield
+    finally:
+        query_cache.invalidate(collection_name)
+
+def iter_documents(
+    collection_name: str,
+    filter_dict: dict = None,
+    projection: Projection = None,
+    batch_size: int = READ_BATCH_SIZE,
+    sort_field: str = "_id",
+    after: Any = None,
+    limit: int = None,
+) -> Iterator[dict]:
+    """Stream matching documents in sort_field order (a top-level field), one page of batch_size at a time.
+
+    Pages are fetched by keyset pagination (sort_field > last value seen,
+    with _id breaking ties) rather than skip or one long-lived cursor, so
+    each page is an index range scan when sort_field is indexed. Documents
+    where sort_field is null or missing come first. Other values should be
+    of one BSON type, since a range only matches its own type. after
+    starts the stream past that sort_field value, e.g. to resume from the
+    last value a previous stream returned.
+    """
+    for page in _iter_pages(collection_name, filter_dict, projection, batch_size, sort_field, after, limit):
+        yield from page
+
+def _iter_pages(collection_name, filter_dict, projection, batch_size, sort_field, after, limit) -> Iterator[List[dict]]:
+    db = _require_db()
+    collection = db[collection_name]
+    batch_size = max(1, batch_size)
+    fields, strip = _keyset_projection(projection, sort_field)
+    sort = [(sort_field, ASCENDING)] if sort_field == "_id" else [(sort_field, ASCENDING), ("_id", ASCENDING)]
+    last = None if after is None else (after, None)
+    remaining = limit
+    _check_plan(collection_name, filter_dict, sort)
+    while remaining is None or remaining > 0:
+        query = filter_dict or {}
+        if last is not None:
+            keyset = _keyset_filter(sort_field, *last)
+            query = {"$and": [query, keyset]} if query else keyset
+        page_size = batch_size if remaining is None else min(batch_size, remaining)
+        page = list(collection.find(query, fields, sort=sort, limit=page_size, batch_size=page_size))
+        if not page:
+            return
+        tail = page[-1]
+        last = (tail.get(sort_field), tail["_id"])
+        if strip:
+            for doc in page:
+                for name in strip:
+                    doc.pop(name, None)
+        yield page
+        if remaining is not None:
+            remaining -= len(page)
+        if len(page) < page_size:
+            return
+
+def _keyset_filter(sort_field: str, value: Any, _id: Any) -> dict:
+    if sort_field == "_id" or _id is None:
+        return {sort_field: {"$gt": value}}
+    if value is None:
+        # Null and missing sort first, but {"$gt": None} matches nothing: continue
+        # with the remaining nulls by _id, then every non-null value
+        return {"$or": [{sort_field: {"$ne": None}}, {sort_field: None, "_id": {"$gt": _id}}]}
+    return {"$or": [{sort_field: {"$gt": value}}, {sort_field: value, "_id": {"$gt": _id}}]}
+
+def _keyset_projection(projection: Projection, sort_field: str) -> Tuple[Optional[dict], Tuple[str, ...]]:
+    """The projection to query with (always returning the keyset fields) and the fields to drop again"""
+    if projection is None:
+        return None, ()
+    fields = dict(projection) if isinstance(projection, Mapping) else {name: 1 for name in projection}
+    inclusive = any(value and name != "_id" for name, value in fields.items())
+    strip = []
+    for name in dict.fromkeys(("_id", sort_field)):
+        if name in fields and not fields[name]:
+            # Explicitly excluded: fetch it anyway (or stop excluding it) and drop it afterwards
+            if inclusive:
+                fields[name] = 1
+            else:
+                del fields[name]
+            strip.append(name)
+        elif inclusive and name not in fields and name != "_id":
+            fields[name] = 1
+            strip.append(name)
+    return fields or None, tuple(strip)
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, max(1, size)))
+        if not batch:
+            return
+        yield batch
+
+def _batch_error(exc: BulkWriteError, offset: int, inserted_before: int) -> BulkWriteError:
+    """exc with writeErrors indexes and nInserted counted over the whole input rather than one batch"""
+    details = dict(exc.details)
+    details["writeErrors"] = [dict(error, index=error["index"] + offset) for error in details.get("writeErrors", [])]
+    details["nInserted"] = inserted_before + details.get("nInserted", 0)
+    return BulkWriteError(details)
+
+class Index(NamedTuple):
+    """An index to create: keys are field names (ascending) or (field, direction) pairs"""
+    keys: Tuple[Union[str, Tuple[str, Any]], ...]
+    unique: bool = False
+    sparse: bool = False
+    name: Optional[str] = None
+
+    def model(self) -> IndexModel:
+        keys = [(key, ASCENDING) if isinstance(key, str) else tuple(key) for key in self.keys]
+        options = {}
+        if self.unique:
+            options["unique"] = True
+        if self.sparse:
+            options["sparse"] = True
+        if self.name:
+            options["name"] = self.name
+        return IndexModel(keys, **options)
+
+def ensure_indexes(collection_name: str, indexes: Iterable[Index]) -> List[str]:
+    """Create indexes on a collection, returning their names.
+
+    Creating an index that already exists with the same options is a no-op;
+    one that conflicts (same keys, other options) raises OperationFailure.
+    """
+    models = [index.model() for index in indexes]
+    if not models:
+        return []
+    db = _require_db()
+    return db[collection_name].create_indexes(models)
+
+def collection_name_for(model: type) -> str:
+    """Collection of a schemas.py model: `__collection__` if set, else the lowercase class name"""
+    return getattr(model, "__collection__", None) or model.__name__.lower()
+
+def schema_models(module=None) -> List[type]:
+    """The Pydantic models defined in schemas.py (or module)"""
+    if module is None:
+        import schemas as module
+    return [
+        value for value in vars(module).values()
+        if isinstance(value, type) and issubclass(value, BaseModel) and value.__module__ == module.__name__
+    ]
+
+def schema_indexes(module=None) -> Dict[str, List[Index]]:
+    """collection -> indexes declared in schemas.py (or module): `__indexes__` on models, plus COLLECTION_INDEXES"""
+    if module is None:
+        import schemas as module
+    declared: Dict[str, List[Index]] = {}
+    for model in schema_models(module):
+        indexes = getattr(model, "__indexes__", ())
+        if indexes:
+            declared.setdefault(collection_name_for(model), []).extend(indexes)
+    for name, indexes in getattr(module, "COLLECTION_INDEXES", {}).items():
+        declared.setdefault(name, []).extend(indexes)
+    return declared
+
+def ensure_schema_indexes(module=None) -> Dict[str, List[str]]:
+    """Create every index declared in schemas.py (see schema_indexes); collection -> index names"""
+    return {name: ensure_indexes(name, indexes) for name, indexes in schema_indexes(module).items()}
+
+
+class CollectionScanError(Exception):
+    """A query's winning plan scans the whole collection (MONGO_EXPLAIN_QUERIES=raise)"""
+
+
+def explain_query(collection_name: str, filter_dict: dict = None, sort: Optional[List[Tuple[str, int]]] = None) -> dict:
+    """Summarise the winning plan of a find: its stages, the indexes it uses and whether it is a COLLSCAN"""
+    db = _require_db()
+
     cursor = db[collection_name].find(filter_dict or {})
-    if limit:
-        cursor = cursor.limit(limit)
-    
-    return list(cursor)
+    if sort:
+        cursor = cursor.sort(sort)
+    plan = cursor.explain()
+    stages, index_names = [], []
+    _walk_plan(plan.get("queryPlanner", {}).get("winningPlan", {}), stages, index_names)
+    return {"stages": stages, "indexes": index_names, "collscan": "COLLSCAN" in stages}
+
+def _walk_plan(node, stages: list, index_names: list):
+    if isinstance(node, list):
+        for child in node:
+            _walk_plan(child, stages, index_names)
+    elif isinstance(node, dict):
+        if isinstance(node.get("stage"), str):
+            stages.append(node["stage"])
+        if isinstance(node.get("indexName"), str) and node["indexName"] not in index_names:
+            index_names.append(node["indexName"])
+        for child in node.values():
+            if isinstance(child, (dict, list)):
+                _walk_plan(child, stages, index_names)
+
+def _query_shape(value):
+    """A filter with its values blanked out, so queries differing only in values share a plan check"""
+    if isinstance(value, Mapping):
+        return tuple(sorted((key, _query_shape(child)) for key, child in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(dict.fromkeys(_query_shape(child) for child in value))
+    return "?"
+
+def _check_plan(collection_name: str, filter_dict: Optional[dict], sort):
+    """Explain each new query shape once when MONGO_EXPLAIN_QUERIES is on and flag collection scans"""
+    if not MONGO_EXPLAIN_QUERIES or not (filter_dict or sort):
+        # Reading a whole collection unsorted is a collection scan by design
+        return
+    shape = (collection_name, _query_shape(filter_dict or {}), tuple(tuple(key) for key in sort or ()))
+    with _explain_lock:
+        if shape in _explained:
+            return
+        _explained.add(shape)
+    try:
+        plan = explain_query(collection_name, filter_dict, sort)
+    except Exception:
+        # Never fail a query because it could not be explained (e.g. an in-memory stand-in client)
+        return
+    if plan["collscan"]:
+        message = (f"Query on {collection_name!r} scans the whole collection: "
+                   f"filter={filter_dict!r} sort={sort!r}; declare an index for it")
+        if MONGO_EXPLAIN_QUERIES == "raise":
+            raise CollectionScanError(message)
+        logger.warning(message)
+
+
+def update_document(collection_name: str, filter_dict: dict, update_data: Union[BaseModel, dict]):
+    """Update the first document matching filter with the given fields, refreshing updated_at"""
+    db = _require_db()
+
+    data_dict = _to_dict(update_data, exclude_unset=True)
+    data_dict['updated_at'] = datetime.now(timezone.utc)
+
+    with _writing(collection_name):
+        result = db[collection_name].update_one(filter_dict, {"$set": data_dict})
+    return result.modified_count
+
+def delete_document(collection_name: str, filter_dict: dict):
+    """Delete the first document matching filter"""
+    db = _require_db()
+
+    with _writing(collection_name):
+        result = db[collection_name].delete_one(filter_dict)
+    return result.deleted_count
+
+
+# Async variants for `async def` routes: the same helpers, run off the event loop
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # More threads than pool connections would only queue for a connection
+                _executor = ThreadPoolExecutor(max_workers=MONGO_MAX_POOL_SIZE, thread_name_prefix="mongo")
+    return _executor
+
+
+async def run_async(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking database call on the database thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def create_document_async(collection_name: str, data: Union[BaseModel, dict]):
+    return await run_async(create_document, collection_name, data)
+
+async def get_documents_async(collection_name: str, filter_dict: dict = None, limit: int = None,
+                              projection: Projection = None, sort: Optional[List[Tuple[str, int]]] = None,
+                              cache: bool = True):
+    return await run_async(get_documents, collection_name, filter_dict, limit, projection, sort, cache)
+
+async def create_documents_async(collection_name: str, items: Iterable[Union[BaseModel, dict]], ordered: bool = True,
+                                 batch_size: int = BULK_BATCH_SIZE):
+    return await run_async(create_documents, collection_name, items, ordered, batch_size)
+
+async def bulk_write_documents_async(collection_name: str, operations: Iterable, ordered: bool = True,
+                                     batch_size: int = BULK_BATCH_SIZE):
+    return await run_async(bulk_write_documents, collection_name, operations, ordered, batch_size)
+
+async def find_document_async(collection_name: str, filter_dict: dict, projection: Projection = None,
+                              sort: Optional[List[Tuple[str, int]]] = None, cache: bool = True):
+    return await run_async(find_document, collection_name, filter_dict, projection, sort, cache)
+
+async def document_exists_async(collection_name: str, filter_dict: dict, cache: bool = True):
+    return await run_async(document_exists, collection_name, filter_dict, cache)
+
+async def iter_documents_async(
+    collection_name: str,
+    filter_dict: dict = None,
+    projection: Projection = None,
+    batch_size: int = READ_BATCH_SIZE,
+    sort_field: str = "_id",
+    after: Any = None,
+    limit: int = None,
+) -> AsyncIterator[dict]:
+    """iter_documents for async routes: one thread pool hop per page, not per document"""
+    pages = _iter_pages(collection_name, filter_dict, projection, batch_size, sort_field, after, limit)
+    try:
+        while True:
+            page = await run_async(next, pages, None)
+            if page is None:
+                return
+            for doc in page:
+                yield doc
+    finally:
+        await run_async(pages.close)
+
+async def update_document_async(collection_name: str, filter_dict: dict, update_data: Union[BaseModel, dict]):
+    return await run_async(update_document, collection_name, filter_dict, update_data)
+
+async def delete_document_async(collection_name: str, filter_dict: dict):
+    return await run_async(delete_document, collection_name, filter_dict)
+
+
+def shutdown():
+    """Stop the async helpers' threads and close the connection pool"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    close_client()
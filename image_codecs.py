@@ -0,0 +1,103 @@
+"""
+Page Image Codecs
+
+Encodes rendered PyMuPDF pixmaps as PNG, JPEG or WebP. PNG and JPEG use
+PyMuPDF's own encoders; WebP needs Pillow built with WebP support and is only
+offered when that is installed.
+
+Lossy codecs accept an optional per-page byte budget: when a page encodes
+larger than the budget, the highest quality that fits is found by binary
+search (never below MIN_QUALITY).
+
+Vector pages are SVG documents rather than encoded pixmaps; image_mime_type
+tells them apart from raster pages by their first bytes.
+"""
+
+from io import BytesIO
+from typing import Callable, NamedTuple
+
+IMAGE_FORMATS = ("png", "jpeg", "webp")
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+# Vector pages (RenderProfile.vector) are SVG whichever codec encodes the raster pages
+SVG_MIME_TYPE = "image/svg+xml"
+
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 20
+
+
+class ImageCodec(NamedTuple):
+    """Output image settings for rendered pages"""
+
+    fmt: str = "png"
+    quality: int = DEFAULT_QUALITY
+    # Per-page byte budget for lossy formats, 0 for none
+    max_bytes: int = 0
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.fmt]
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies the encoded output in cache keys"""
+        if self.fmt == "png":
+            return "png"
+        return f"{self.fmt}-q{self.quality}-b{self.max_bytes}"
+
+
+def image_mime_type(data: bytes, default: str) -> str:
+    """MIME type of one page image: SVG for vector pages, default (the codec's type) otherwise"""
+    return SVG_MIME_TYPE if data.startswith((b"<svg", b"<?xml")) else default
+
+
+def webp_available() -> bool:
+    try:
+        from PIL import features
+    except ImportError:
+        return False
+    return bool(features.check("webp"))
+
+
+def _encoder(pix, fmt: str) -> Callable[[int], bytes]:
+    """Return quality -> bytes for one pixmap, reusing any per-pixmap setup"""
+    if fmt == "jpeg":
+        return lambda quality: pix.tobytes(output="jpeg", jpg_quality=quality)
+
+    from PIL import Image
+
+    mode = "RGB" if pix.n == 3 else "L"
+    image = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+    def encode(quality: int) -> bytes:
+        buf = BytesIO()
+        image.save(buf, format="WEBP", quality=quality)
+        return buf.getvalue()
+
+    return encode
+
+
+def encode_pixmap(pix, codec: ImageCodec) -> bytes:
+    """Encode a fitz.Pixmap with codec, honouring its byte budget for lossy formats"""
+    if codec.fmt == "png":
+        return pix.tobytes(output="png")
+
+    encode = _encoder(pix, codec.fmt)
+    data = encode(codec.quality)
+    if not codec.max_bytes or len(data) <= codec.max_bytes:
+        return data
+
+    best = None
+    smallest = data
+    lo, hi = MIN_QUALITY, codec.quality - 1
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        candidate = encode(quality)
+        if len(candidate) <= codec.max_bytes:
+            best, lo = candidate, quality + 1
+        else:
+            if len(candidate) < len(smallest):
+                smallest = candidate
+            hi = quality - 1
+    # Nothing fits: ship the smallest attempt rather than failing the page
+    return best if best is not None else smallest
@@ -0,0 +1,350 @@
+"""
+Conversion Jobs
+
+Background conversion jobs for PDFs too large for one synchronous request.
+A job is queued on a worker pool bounded by JOB_WORKERS, reports progress as
+pages rendered out of total, writes the finished flipbook to JOB_DIR and can
+be cancelled while queued or running. At most JOB_WORKERS + JOB_QUEUE_DEPTH
+jobs may be pending (each holds its upload); further submissions raise
+JobQueueFull so callers can answer 503.
+
+Job metadata lives in the "conversion_jobs" MongoDB collection through the
+database.py helpers, or in one JSON file per job in JOB_DIR when no database
+is configured. Either way every server worker sharing them can report on a
+job and request its cancellation, which the worker running the job picks up.
+
+Configure with environment variables:
+- JOB_WORKERS: conversions running at once (default: CPU count)
+- JOB_QUEUE_DEPTH: jobs allowed to wait for a worker (default: 16)
+- JOB_DIR: where finished flipbooks are written (default: <tmp>/flipbook-jobs)
+- JOB_RESULT_TTL_SECONDS: finished flipbooks (and file job metadata) older
+  than this are deleted, 0 keeps them (default: 86400)
+- JOB_DRAIN_SECONDS: on shutdown, how long running jobs may keep going before
+  they are cancelled (default: 0)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: file job store updates are then not serialised across processes
+    fcntl = None
+
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", os.cpu_count() or 1)))
+JOB_QUEUE_DEPTH = max(0, int(os.getenv("JOB_QUEUE_DEPTH", 16)))
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(tempfile.gettempdir(), "flipbook-jobs"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", 24 * 3600))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", 0))
+JOB_COLLECTION = "conversion_jobs"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Minimum seconds between progress writes to the job store
+PROGRESS_INTERVAL = 0.5
+# Minimum seconds between scans of JOB_DIR for expired results
+CLEANUP_INTERVAL = 60.0
+# On shutdown, seconds cancelled jobs get to stop before the caller tears down what they use
+CANCEL_WAIT_SECONDS = 10.0
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested"""
+
+
+class JobQueueFull(Exception):
+    """Raised by submit when every worker and queue position is taken"""
+
+
+class FileJobStore:
+    """Job metadata as <job_id>.json files, shared by the processes using one job directory"""
+
+    def __init__(self, job_dir: str = JOB_DIR):
+        self.job_dir = job_dir
+        os.makedirs(job_dir, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def create(self, job: dict):
+        now = datetime.now(timezone.utc).isoformat()
+        path = self._path(job["job_id"])
+        # Published complete, so readers never see a partly written file
+        staging = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(staging, "w") as f:
+            json.dump({**job, "created_at": now, "updated_at": now}, f)
+        os.replace(staging, path)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_SH)
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id: str, **fields):
+        try:
+            f = open(self._path(job_id), "r+")
+        except OSError:
+            return
+        with f:
+            # Read, change and write back under one lock: progress and cancel requests come from different workers
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            job = json.load(f)
+            job.update(fields, updated_at=datetime.now(timezone.utc).isoformat())
+            f.seek(0)
+            f.truncate()
+            json.dump(job, f)
+
+
+class MongoJobStore:
+    """Job metadata in the conversion_jobs collection"""
+
+    def create(self, job: dict):
+        from database import create_document
+
+        create_document(JOB_COLLECTION, job)
+
+    def ensure_indexes(self):
+        """Index job_id, which every lookup and update filters on"""
+        from database import Index, ensure_indexes
+
+        ensure_indexes(JOB_COLLECTION, [Index(("job_id",), unique=True)])
+
+    def get(self, job_id: str) -> Optional[dict]:
+        from database import find_document
+
+        # Never from the query cache: status, progress and cancellation are written by other workers
+        return find_document(JOB_COLLECTION, {"job_id": job_id}, {"_id": 0}, cache=False)
+
+    def update(self, job_id: str, **fields):
+        from database import update_document
+
+        update_document(JOB_COLLECTION, {"job_id": job_id}, fields)
+
+
+def default_job_store(job_dir: str = JOB_DIR):
+    """MongoDB-backed store when the database is configured, files in job_dir otherwise"""
+    try:
+        from database import is_configured
+    except Exception:
+        return FileJobStore(job_dir)
+    return MongoJobStore() if is_configured() else FileJobStore(job_dir)
+
+
+class JobManager:
+    """Runs conversion jobs on a bounded pool and tracks them in a job store.
+
+    runner(output_file, report_progress, *args) writes the flipbook to the
+    binary file object and calls report_progress(pages_done, total_pages) as
+    it goes; report_progress raises JobCancelled once the job is cancelled.
+    """
+
+    def __init__(
+        self,
+        runner: Callable,
+        store=None,
+        workers: int = JOB_WORKERS,
+        job_dir: str = JOB_DIR,
+        queue_depth: int = JOB_QUEUE_DEPTH,
+        result_ttl: float = JOB_RESULT_TTL_SECONDS,
+    ):
+        self.runner = runner
+        self._store = store
+        self.job_dir = job_dir
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.result_ttl = result_ttl
+        # Submissions past the limit check whose future does not exist yet
+        self._admitting = 0
+        self._next_cleanup = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        os.makedirs(job_dir, exist_ok=True)
+
+    @property
+    def store(self):
+        """The job store, chosen on first use so creating a manager does not load the database layer"""
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = default_job_store(self.job_dir)
+        return self._store
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.html")
+
+    @property
+    def pending(self) -> int:
+        """Jobs queued or running in this process"""
+        with self._lock:
+            return len(self._futures) + self._admitting
+
+    def submit(self, filename: str, *args) -> str:
+        """Queue a job and return its ID, or raise JobQueueFull. Blocks on the job store."""
+        with self._lock:
+            pending = len(self._futures) + self._admitting
+            if pending >= self.workers + self.queue_depth:
+                raise JobQueueFull(
+                    f"{pending} jobs pending (limit {self.workers} running + {self.queue_depth} queued)"
+                )
+            self._admitting += 1
+        try:
+            self.remove_expired_results()
+            job_id = uuid.uuid4().hex
+            self.store.create({
+                "job_id": job_id,
+                "status": QUEUED,
+                "filename": filename,
+                "pages_done": 0,
+                "total_pages": None,
+                "error": None,
+                "cancel_requested": False,
+            })
+            with self._lock:
+                self._cancel_events[job_id] = threading.Event()
+                self._futures[job_id] = self._executor.submit(self._run, job_id, *args)
+        finally:
+            with self._lock:
+                self._admitting -= 1
+        return job_id
+
+    def remove_expired_results(self, force: bool = False) -> int:
+        """Delete results, file job store entries and abandoned partial files older than result_ttl.
+
+        Returns the number of files removed. Scans JOB_DIR at most every
+        CLEANUP_INTERVAL seconds unless force.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.result_ttl <= 0 or (not force and now < self._next_cleanup):
+                return 0
+            self._next_cleanup = now + CLEANUP_INTERVAL
+        cutoff = time.time() - self.result_ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.job_dir))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith((".html", ".html.part", ".json", ".tmp")):
+                continue
+            try:
+                # A running job's partial file and metadata are written as pages are done, so they stay fresh
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Request cancellation; returns the job, or None if it does not exist"""
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        self.store.update(job_id, cancel_requested=True)
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+            future = self._futures.get(job_id)
+        if event is not None:
+            event.set()
+        if future is not None and future.cancel():
+            # Never started: nothing will run to record the cancellation
+            self._finish(job_id)
+            self.store.update(job_id, status=CANCELLED)
+        return self.store.get(job_id)
+
+    def _finish(self, job_id: str):
+        with self._lock:
+            self._cancel_events.pop(job_id, None)
+            self._futures.pop(job_id, None)
+
+    def _run(self, job_id: str, *args):
+        event = self._cancel_events[job_id]
+        last_write = 0.0
+
+        def report_progress(pages_done: int, total_pages: int):
+            nonlocal last_write
+            now = time.monotonic()
+            if pages_done == 0 or pages_done == total_pages or now - last_write >= PROGRESS_INTERVAL:
+                last_write = now
+                self.store.update(job_id, pages_done=pages_done, total_pages=total_pages)
+                job = self.store.get(job_id)
+                if job is not None and job.get("cancel_requested"):
+                    event.set()
+            if event.is_set():
+                raise JobCancelled()
+
+        partial = self.result_path(job_id) + ".part"
+        try:
+            job = self.store.get(job_id)
+            if event.is_set() or (job is not None and job.get("cancel_requested")):
+                # Cancelled while queued, possibly through another worker
+                raise JobCancelled()
+            self.store.update(job_id, status=RUNNING)
+            with open(partial, "wb") as output_file:
+                self.runner(output_file, report_progress, *args)
+            os.replace(partial, self.result_path(job_id))
+            self.store.update(job_id, status=DONE)
+        except JobCancelled:
+            self.store.update(job_id, status=CANCELLED)
+        except Exception as e:
+            if event.is_set():
+                # Cancelled mid-page, e.g. the render pool was shut down under it
+                self.store.update(job_id, status=CANCELLED)
+            else:
+                detail = getattr(e, "detail", None) or str(e)
+                self.store.update(job_id, status=FAILED, error=str(detail)[:500])
+        finally:
+            if os.path.exists(partial):
+                os.unlink(partial)
+            self._finish(job_id)
+
+    def shutdown(self, wait: bool = True, drain_timeout: float = JOB_DRAIN_SECONDS):
+        """Cancel queued jobs; wait for running ones to finish, or cancel them too.
+
+        Without wait, running jobs still get drain_timeout seconds to finish
+        before they are cancelled, then up to CANCEL_WAIT_SECONDS to stop at
+        their next page, so they end CANCELLED before the render pool goes away.
+        """
+        with self._lock:
+            pending = list(self._futures.items())
+            events = list(self._cancel_events.values())
+        running = []
+        for job_id, future in pending:
+            if future.cancel():
+                self._finish(job_id)
+                self.store.update(job_id, status=CANCELLED, error="Server shut down before the job started")
+            else:
+                running.append(future)
+        if not wait:
+            if running and drain_timeout > 0:
+                wait_for_futures(running, timeout=drain_timeout)
+            for event in events:
+                event.set()
+            if running:
+                wait_for_futures(running, timeout=CANCEL_WAIT_SECONDS)
+        self._executor.shutdown(wait=wait)
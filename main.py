@@ -1,13 +1,147 @@
 import os
+import asyncio
 import base64
+import binascii
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
 from io import BytesIO
-from typing import List
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 
-app = FastAPI()
+from compression import CompressedPrefix, compress_stream, negotiate_encoding, offered_encodings
+from conversion_cache import (
+    ASSET_STORE_DIR,
+    ASSET_STORE_MAX_BYTES,
+    DOCUMENT_CACHE_DIR,
+    DOCUMENT_CACHE_MAX_BYTES,
+    MANIFEST_CACHE_DIR,
+    MANIFEST_CACHE_MAX_BYTES,
+    PAGE_CACHE_MAX_BYTES,
+    PAYLOAD_CACHE_DIR,
+    PAYLOAD_CACHE_MAX_BYTES,
+    ConversionCache,
+    cache_key,
+)
+from conversion_executor import ConversionExecutor, ConversionQueueFull
+from image_codecs import (
+    DEFAULT_QUALITY,
+    FORMAT_ALIASES,
+    IMAGE_FORMATS,
+    MIME_TYPES,
+    SVG_MIME_TYPE,
+    ImageCodec,
+    image_mime_type,
+    webp_available,
+)
+from jobs import DONE, JobManager, JobQueueFull
+from metrics import METRICS_ENABLED, SERVER_TIMING, StageTimings, new_timings, registry as metrics_registry
+from renderer import (
+    DEVICE_PROFILES,
+    FINGERPRINT_VERSION,
+    RenderProfile,
+    document_info,
+    iter_pdf_page_sets,
+    shutdown_render_pool,
+    warm_render_pool,
+)
+from uploads import PdfSource, UploadRejected, as_pdf_source, receive_pdf_upload
+
+# "warm": load PyMuPDF, start the render workers, prime the compressed shell and
+# connect to the database before the port accepts traffic. "lazy": serve at once
+# and pay each of those on first use (fast cold starts for scale-to-zero).
+STARTUP_MODE = "warm" if os.getenv("STARTUP_MODE", "lazy").strip().lower() == "warm" else "lazy"
+
+# Seconds the last startup took (lifespan start to accepting traffic)
+_startup_seconds = 0.0
+
+# Lazy mode's background database preparation, waited for (up to the timeout) on shutdown
+_startup_thread: Optional[threading.Thread] = None
+STARTUP_THREAD_JOIN_SECONDS = 5.0
+
+# Set once the executors below have been shut down; the next startup replaces them
+_workers_stopped = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _startup_seconds, _startup_thread
+    start = time.perf_counter()
+    if _workers_stopped:
+        _restart_conversion_workers()
+    if STARTUP_MODE == "warm":
+        _warm_up()
+    else:
+        # Indexes are still created, off the startup path
+        _startup_thread = threading.Thread(
+            target=_prepare_database, args=(False,), name="database-startup", daemon=True
+        )
+        _startup_thread.start()
+    _startup_seconds = time.perf_counter() - start
+    try:
+        yield
+    finally:
+        _stop_conversion_workers()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Bounded pool for blocking conversion work, keeps the event loop responsive
+conversion_executor = ConversionExecutor()
+
+# Limits for caller-supplied render widths
+MIN_RENDER_WIDTH = 100
+MAX_RENDER_WIDTH = 3000
+MAX_RENDER_WIDTHS = 4
+
+# Pages kept decoded on each side of the current one in lazy mode
+DEFAULT_LAZY_WINDOW = 2
+MAX_LAZY_WINDOW = 50
+
+# Rendered pages of recent conversions, keyed by PDF hash and render parameters
+conversion_cache = ConversionCache(max_bytes=PAGE_CACHE_MAX_BYTES)
+
+# Encoded page <div> payloads, so password or turn() changes only rebuild the shell
+payload_cache = ConversionCache(root=PAYLOAD_CACHE_DIR, max_bytes=PAYLOAD_CACHE_MAX_BYTES)
+
+# Page assets of split-output flipbooks, served individually by GET /api/flipbooks/...
+asset_store = ConversionCache(root=ASSET_STORE_DIR, max_bytes=ASSET_STORE_MAX_BYTES)
+
+# Page fingerprints of each conversion, compared against by incremental conversions
+page_manifests = ConversionCache(root=MANIFEST_CACHE_DIR, max_bytes=MANIFEST_CACHE_MAX_BYTES)
+
+# Page count, sizes and fingerprints per document, shared by conversions and jobs
+document_cache = ConversionCache(root=DOCUMENT_CACHE_DIR, max_bytes=DOCUMENT_CACHE_MAX_BYTES)
+
+# Page range selections accepted per conversion
+MAX_PAGE_RANGES = 32
+
+# Thumbnail strip of /api/preview: small lossy renders of every page
+THUMBNAIL_PROFILE = RenderProfile((int(os.getenv("PREVIEW_THUMBNAIL_WIDTH", 120)),))
+THUMBNAIL_CODEC = ImageCodec("jpeg", 60)
+
+# Seconds /api/preview may spend on thumbnails before answering with a partial strip
+PREVIEW_TIME_BUDGET = float(os.getenv("PREVIEW_TIME_BUDGET", 1.5))
+
+# Thumbnail strips that did not fit the budget being finished in the background,
+# each on a conversion executor slot; beyond this many, further ones are dropped
+PREVIEW_MAX_BACKFILLS = max(0, int(os.getenv("PREVIEW_MAX_BACKFILLS", 1)))
+_preview_backfills: set = set()
+
+# Absolute URL prefix (ending in /) for asset links in split-output shells;
+# defaults to the URL the conversion request arrived on
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
+if PUBLIC_BASE_URL and not PUBLIC_BASE_URL.endswith("/"):
+    PUBLIC_BASE_URL += "/"
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,9 +149,79 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Conversion-Id", "Server-Timing"],
 )
 
 
+def _warm_up():
+    """Pay the first-request costs before serving"""
+    import fitz  # noqa: F401  # PyMuPDF, used in this process for small documents and previews
+
+    warm_render_pool()
+    if "gzip" in offered_encodings():
+        # gzip responses continue from the cached compressor state after the head
+        # (brotli state cannot be copied, so there is nothing to prime for it)
+        _COMPRESSED_HEAD.start("gzip")
+    _prepare_database(connect=True)
+
+
+def _prepare_database(connect: bool):
+    """Open the MongoDB pool (when connect) and create the declared indexes, if a database is configured"""
+    try:
+        import database
+    except ImportError:
+        return
+    if not database.is_configured():
+        return
+    try:
+        if connect:
+            database.connect()
+        if database.MONGO_ENSURE_INDEXES:
+            # The indexes declared in schemas.py, and the job store's
+            database.ensure_schema_indexes()
+            if hasattr(conversion_jobs.store, "ensure_indexes"):
+                conversion_jobs.store.ensure_indexes()
+    except Exception as exc:
+        # An unreachable database must not keep the converter from starting
+        database.logger.warning("Database not ready at startup: %s", exc)
+
+
+def _restart_conversion_workers():
+    """Replace the executors a previous shutdown stopped (the app is started again in this process)"""
+    global conversion_executor, conversion_jobs, _workers_stopped
+    conversion_executor = ConversionExecutor()
+    conversion_jobs = JobManager(_run_conversion_job)
+    _preview_backfills.clear()
+    _workers_stopped = False
+
+
+def _close_database():
+    if _startup_thread is not None:
+        # Lazy startup imports the database layer on that thread: never shut it down half-imported
+        _startup_thread.join(STARTUP_THREAD_JOIN_SECONDS)
+        if _startup_thread.is_alive():
+            return
+    if "database" in sys.modules:
+        # Close the MongoDB pool if anything used the database layer
+        sys.modules["database"].shutdown()
+
+
+def _stop_conversion_workers():
+    """Stop every pool; a step that fails does not keep the later ones from running"""
+    global _workers_stopped
+    _workers_stopped = True
+    try:
+        conversion_jobs.shutdown(wait=False)
+    finally:
+        try:
+            conversion_executor.shutdown()
+        finally:
+            try:
+                _close_database()
+            finally:
+                shutdown_render_pool()
+
+
 @app.get("/")
 def read_root():
     return {"message": "Hello from FastAPI Backend!"}
@@ -66,13 +270,42 @@ def test_database():
         response["database"] = f"❌ Error: {str(e)[:50]}"
     
     # Check environment variables
-    import os
     response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
     response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
     
     return response
 
 
+metrics_registry.gauge(
+    "flipbook_conversions_running", "Conversions holding an executor slot.", lambda: conversion_executor.running
+)
+metrics_registry.gauge(
+    "flipbook_conversions_queued", "Conversions waiting for an executor slot.", lambda: conversion_executor.queued
+)
+metrics_registry.gauge("flipbook_jobs_pending", "Background jobs queued or running.", lambda: conversion_jobs.pending)
+metrics_registry.gauge("flipbook_page_cache_bytes", "Bytes held by the page cache.", lambda: conversion_cache.stats()["bytes"])
+metrics_registry.gauge(
+    "flipbook_startup_seconds", f"Seconds startup took before serving ({STARTUP_MODE} mode).", lambda: _startup_seconds
+)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Conversion counters, stage timings, latency histograms and in-flight gauges (Prometheus text format)"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (set METRICS_ENABLED=1).")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache/stats")
+def conversion_cache_stats():
+    """Hit/miss/eviction counters of the page and payload caches (and the database query cache), for sizing them"""
+    stats = {"pages": conversion_cache.stats(), "payloads": payload_cache.stats(), "assets": asset_store.stats()}
+    if "database" in sys.modules:
+        stats["queries"] = sys.modules["database"].query_cache.stats()
+    return stats
+
+
 # Minimal jQuery-compatible shim sufficient for our subset usage
 # Supports: $(selector), $(fn) ready, $.extend, $.fn plugin, .children(sel), .hide/.show, .eq, .on,
 # .width/.height, .css, .addClass/.removeClass, .offset, $('<div>').appendTo, $(window)
@@ -120,7 +353,7 @@ TURNJS_MIN = """
       var $pages = $wrap.children('.page');
       var current = 0, dragging=false, startX=0;
       function setSize(){ var vw = $(window).width(); var r = Math.min(vw, settings.width); var h = r*settings.height/settings.width; $wrap.css({width:r+'px', height:h+'px'}); }
-      function show(i){ i=Math.max(0, Math.min($pages.nodes.length-1, i)); $pages.hide().eq(i).show(); current=i; }
+      function show(i){ i=Math.max(0, Math.min($pages.nodes.length-1, i)); $pages.hide().eq(i).show(); current=i; $wrap.nodes[0].dispatchEvent(new CustomEvent('turned',{detail:{page:i}})); }
       function startDrag(e){ dragging=true; startX = (e.touches? e.touches[0].clientX : (e.clientX|| (e.changedTouches? e.changedTouches[0].clientX:0))); $wrap.addClass('dragging'); e.preventDefault && e.preventDefault(); }
       function moveDrag(e){ if(!dragging) return; var x = (e.touches? e.touches[0].clientX : (e.clientX|| (e.changedTouches? e.changedTouches[0].clientX:startX))); var dx=x-startX; var progress=Math.max(-1,Math.min(1,dx/($wrap.width()*0.8))); var deg = -progress*25; var sh = Math.abs(progress)*0.6; $pages.eq(current).css({boxShadow:'rgba(0,0,0,'+sh+') 0px 8px 24px', transform:'perspective(1000px) rotate('+deg+'deg)'}); }
       function endDrag(e){ if(!dragging) return; var x = (e.changedTouches? e.changedTouches[0].clientX : (e.clientX||startX)); var dx=x-startX; if(Math.abs(dx) > $wrap.width()*0.25){ if(dx<0 && current<$pages.nodes.length-1) show(current+1); else if(dx>0 && current>0) show(current-1); }
@@ -136,31 +369,243 @@ TURNJS_MIN = """
 """.strip()
 
 
+def _b64_image(image_bytes: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
 def _b64_png(image_bytes: bytes) -> str:
-    return f"data:image/png;base64,{base64.b64encode(image_bytes).decode('ascii')}"
+    return _b64_image(image_bytes, "image/png")
+
+
+# Input bytes per base64 slice; a multiple of 3, so the encoded slices concatenate without padding
+BASE64_CHUNK_BYTES = 3 * 128 * 1024
+
+
+def _b64_chunks(image_bytes: bytes) -> Iterator[bytes]:
+    """Base64 of image_bytes in slices, encoded from memoryviews without copying the input"""
+    view = memoryview(image_bytes)
+    for start in range(0, len(view), BASE64_CHUNK_BYTES):
+        yield binascii.b2a_base64(view[start:start + BASE64_CHUNK_BYTES], newline=False)
+
+
+PageRanges = Tuple[Tuple[int, Optional[int]], ...]
+
+
+class DedupStats:
+    """What one conversion saved by not repeating identical pages"""
+
+    def __init__(self):
+        # Pages sent as references to an identical earlier page, and the output bytes that saved
+        self.pages = 0
+        self.bytes = 0
+        # Pages copied from an identical earlier page instead of being rendered
+        self.renders = 0
+
+
+def _select_pages(pages: PageRanges, page_count: int) -> List[int]:
+    """0-based indices of the pages selected by 1-based (first, last) ranges, in document order"""
+    selected = set()
+    for first, last in pages:
+        if first > page_count:
+            raise HTTPException(
+                status_code=400, detail=f"Page {first} is out of range: the document has {page_count} pages."
+            )
+        selected.update(range(first - 1, min(last or page_count, page_count)))
+    return sorted(selected)
+
+
+def _document_info(source: PdfSource, timings: Optional[StageTimings] = None) -> dict:
+    """Page count, sizes and fingerprints of a document (renderer.document_info), cached by content hash"""
+    key = cache_key(source.sha256, FINGERPRINT_VERSION)
+    cached = document_cache.get(key)
+    if cached is not None:
+        return json.loads(b"".join(cached))
+    start = time.perf_counter()
+    info = document_info(source.document)
+    if timings is not None:
+        timings.add("parse", time.perf_counter() - start)
+    for _ in document_cache.store(key, [json.dumps(info).encode("utf-8")], fmt="json"):
+        pass
+    return info
+
+
+def _render_ids(profile: RenderProfile, codec: ImageCodec, pages: Optional[PageRanges] = None) -> Tuple[str, ...]:
+    """Render parameter ids for cache keys; a page selection gets a short hash of its ranges"""
+    if not pages:
+        return profile.cache_id, codec.cache_id
+    spec = ",".join(f"{first}-{last or ''}" for first, last in sorted(pages))
+    return profile.cache_id, codec.cache_id, "pg" + hashlib.sha256(spec.encode("ascii")).hexdigest()[:12]
+
+
+def _conversion_id(
+    source: PdfSource, profile: RenderProfile, codec: ImageCodec, pages: Optional[PageRanges] = None
+) -> str:
+    """Content-addressed ID of a conversion's rendered pages (also its asset path in split mode)"""
+    return cache_key(source.sha256, *_render_ids(profile, codec, pages))
+
 
+def _stored_image_path(conversion_id: str, index: int, fmt: str) -> Optional[str]:
+    return conversion_cache.path(conversion_id, index, fmt) or asset_store.path(conversion_id, index, fmt)
 
-def _render_pdf_to_images(pdf_bytes: bytes, target_width: int = 900) -> List[bytes]:
-    """Render each page of PDF to PNG bytes using PyMuPDF (fitz)."""
+
+def _reusable_pages(previous: str, fingerprints: List[str], per_page: int, fmt: str) -> Dict[int, List[str]]:
+    """Map positions of unchanged pages to the image files of the same page in a previous conversion"""
+    manifest = page_manifests.get(previous)
+    if manifest is None:
+        raise HTTPException(
+            status_code=409, detail="The previous conversion is no longer available; convert without 'previous'."
+        )
+    positions = {}
+    for position, fingerprint in enumerate(b"".join(manifest).decode("ascii").split()):
+        positions.setdefault(fingerprint, position)
+    reused = {}
+    for position, fingerprint in enumerate(fingerprints):
+        old = positions.get(fingerprint)
+        if old is None:
+            continue
+        paths = [_stored_image_path(previous, old * per_page + j, fmt) for j in range(per_page)]
+        if all(paths):
+            reused[position] = paths
+    return reused
+
+
+def _read_images(paths: List[str]) -> Optional[List[bytes]]:
+    images = []
+    try:
+        for path in paths:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    except OSError:
+        return None
+    return images
+
+
+def _render_page_sets(
+    source: PdfSource,
+    conversion_id: str,
+    profile: RenderProfile,
+    codec: ImageCodec,
+    pages: Optional[PageRanges] = None,
+    previous: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+    dedup: Optional[DedupStats] = None,
+) -> Iterator[List[bytes]]:
+    """Render the selected pages and record their fingerprints under conversion_id.
+
+    A page with the same fingerprint as an earlier selected page is not
+    rendered: it repeats that page's images. With a previous conversion ID,
+    pages whose fingerprint matches a page of that conversion are copied from
+    its stored images instead of rendered. dedup, if given, counts the renders
+    saved by repeated pages.
+    """
+    info = _document_info(source, timings)
+    indices = _select_pages(pages, info["page_count"]) if pages else list(range(info["page_count"]))
+    fingerprints = [info["pages"][i]["fingerprint"] for i in indices]
+    reused = _reusable_pages(previous, fingerprints, len(profile.widths), codec.fmt) if previous else {}
+    for _ in page_manifests.store(conversion_id, ["\n".join(fingerprints).encode("ascii")], fmt="txt"):
+        pass
+
+    duplicates = _duplicate_positions(fingerprints)
+    # Images of pages that later duplicates repeat, dropped once the last one has been yielded
+    pending = Counter(duplicates.values())
+    held: Dict[int, List[bytes]] = {}
+    changed = [
+        index for position, index in enumerate(indices) if position not in reused and position not in duplicates
+    ]
+    rendered = iter_pdf_page_sets(source.document, profile, codec=codec, pages=changed, timings=timings)
+    for position, index in enumerate(indices):
+        original = duplicates.get(position)
+        if original is not None:
+            images = held[original]
+            pending[original] -= 1
+            if not pending[original]:
+                del held[original]
+            if dedup is not None:
+                dedup.renders += 1
+        elif position not in reused:
+            images = next(rendered)
+        else:
+            images = _read_images(reused[position])
+            if images is None:
+                # Evicted from the previous conversion since it was matched
+                images = next(
+                    iter_pdf_page_sets(source.document, profile, workers=1, codec=codec, pages=[index], timings=timings)
+                )
+        if pending.get(position):
+            held[position] = images
+        yield images
+
+
+def _duplicate_positions(fingerprints: List[str]) -> Dict[int, int]:
+    """Map each position whose fingerprint already occurred to the first position with it"""
+    first: Dict[str, int] = {}
+    duplicates = {}
+    for position, fingerprint in enumerate(fingerprints):
+        original = first.setdefault(fingerprint, position)
+        if original != position:
+            duplicates[position] = original
+    return duplicates
+
+
+def _iter_pdf_to_page_sets(
+    pdf: Union[bytes, PdfSource],
+    profile: RenderProfile = RenderProfile(),
+    codec: ImageCodec = ImageCodec(),
+    pages: Optional[PageRanges] = None,
+    previous: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+    dedup: Optional[DedupStats] = None,
+    cache: Optional[ConversionCache] = None,
+) -> Iterator[List[bytes]]:
+    """Render each (selected) page of PDF at every profile width using PyMuPDF (fitz), across the render pool.
+
+    The images are kept in cache (default: the page cache) under the conversion ID.
+    """
     try:
         import fitz  # PyMuPDF
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"PyMuPDF not installed: {e}")
 
-    images: List[bytes] = []
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        for page in doc:
-            zoom = target_width / page.rect.width
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img_bytes = pix.tobytes(output="png")
-            images.append(img_bytes)
-    return images
+    # Re-uploads of the same document with the same settings skip rendering entirely.
+    # The cache holds a flat list of images, len(profile.widths) per page.
+    source = as_pdf_source(pdf)
+    cache = cache or conversion_cache
+    key = _conversion_id(source, profile, codec, pages)
+    images = cache.get(key)
+    if images is None:
+        page_sets = _render_page_sets(source, key, profile, codec, pages, previous, timings, dedup)
+        images = cache.store(key, (img for page_set in page_sets for img in page_set), fmt=codec.fmt)
+    page_set = []
+    for img in images:
+        page_set.append(img)
+        if len(page_set) == len(profile.widths):
+            yield page_set
+            page_set = []
 
 
-def _build_single_file_html(image_data_urls: List[str], password: str) -> str:
-    # CSS for smartphone portrait single page, visible edge, no print/copy
-    css = """
+def _iter_pdf_to_images(
+    pdf: Union[bytes, PdfSource],
+    target_width: int = 900,
+    codec: ImageCodec = ImageCodec(),
+    pages: Optional[PageRanges] = None,
+) -> Iterator[bytes]:
+    """Render each (selected) page of PDF to image bytes using PyMuPDF (fitz), across the render pool."""
+    for page_set in _iter_pdf_to_page_sets(pdf, RenderProfile((target_width,)), codec=codec, pages=pages):
+        yield page_set[0]
+
+
+def _render_pdf_to_images(
+    pdf: Union[bytes, PdfSource],
+    target_width: int = 900,
+    codec: ImageCodec = ImageCodec(),
+    pages: Optional[PageRanges] = None,
+) -> List[bytes]:
+    """Render each (selected) page of PDF to image bytes using PyMuPDF (fitz), across the render pool."""
+    return list(_iter_pdf_to_images(pdf, target_width=target_width, codec=codec, pages=pages))
+
+
+# CSS for smartphone portrait single page, visible edge, no print/copy
+FLIPBOOK_CSS = """
     html, body { height: 100%; margin: 0; background: #0b0b0e; color:#fff; }
     body { -webkit-user-select: none; -ms-user-select: none; user-select: none; overscroll-behavior: contain; touch-action: pan-y; }
     #app { height: 100%; display:flex; align-items:center; justify-content:center; padding: 12px; box-sizing: border-box; }
@@ -176,8 +621,9 @@ def _build_single_file_html(image_data_urls: List[str], password: str) -> str:
     @media print { body * { display: none !important; } }
     """
 
-    # Security / UX JS: password gate, disable copy/print, key traps, simple tamper checks
-    security_js = """
+# Security / UX JS: password gate, disable copy/print, key traps, simple tamper checks
+# __PASS__ is replaced with the JS string literal of the password per flipbook
+SECURITY_JS = """
       (function(){
         var PASS = __PASS__;
         function deny(){ alert('Access denied'); document.body.innerHTML=''; }
@@ -197,78 +643,1007 @@ def _build_single_file_html(image_data_urls: List[str], password: str) -> str:
         document.documentElement.style.visibility='hidden';
         window.addEventListener('load', promptPass, false);
       })();
-    """.replace("__PASS__", repr(password))
+    """
 
-    # Build pages HTML
-    pages_html = []
-    for idx, data_url in enumerate(image_data_urls):
-        pages_html.append(f'<div class="page"><img src="{data_url}" alt="Page {idx+1}"/></div>')
-    pages_str = "\n".join(pages_html)
+# turn() options used when the caller does not override them
+TURN_OPTIONS = {
+    "width": 390,
+    "height": 552,
+    "display": "single",
+    "elevation": 60,
+    "gradients": True,
+    "autoCenter": True,
+}
+TURN_DISPLAYS = ("single", "double")
+
+# __TURN_OPTIONS__ is replaced with the JSON turn() options per flipbook
+# Lazy mode: page images sit inert in <template> blocks and are materialised
+# only within __LAZY_WINDOW__ pages of the current one; pages that fall
+# outside the window drop their <img> so the browser can free the bitmap
+LAZY_JS = """
+      (function(){
+        var WINDOW = __LAZY_WINDOW__;
+        var pages = document.querySelectorAll('#flipbook > .page');
+        function load(p){ if(!p.querySelector('img')){ var t=p.querySelector('template'); if(t) p.appendChild(t.content.cloneNode(true)); } }
+        function release(p){ var img=p.querySelector(':scope > img'); if(img){ img.removeAttribute('srcset'); img.removeAttribute('src'); p.removeChild(img); } }
+        function update(current){ for(var i=0;i<pages.length;i++){ if(Math.abs(i-current)<=WINDOW) load(pages[i]); else release(pages[i]); } }
+        document.getElementById('flipbook').addEventListener('turned', function(e){ update(e.detail.page); });
+        update(0);
+      })();
+    """
 
-    init_js = """
+# A page identical to an earlier one is sent as <div class="page" data-same="N">;
+# it gets a copy of page N's <img> (or lazy <template>) before the other scripts run
+DEDUP_JS = """
+      (function(){
+        var pages = document.querySelectorAll('#flipbook > .page');
+        for(var i=0;i<pages.length;i++){
+          var same = pages[i].getAttribute('data-same');
+          if(same===null) continue;
+          var copy = pages[+same].firstElementChild.cloneNode(true);
+          var img = copy.tagName==='TEMPLATE' ? copy.content.firstElementChild : copy;
+          img.setAttribute('alt', 'Page '+(i+1));
+          pages[i].appendChild(copy);
+        }
+      })();
+    """
+
+INIT_JS = """
       $(function(){
-        $('#flipbook').turn({
-          width: 390,
-          height: 552,
-          display: 'single',
-          elevation: 60,
-          gradients: true,
-          autoCenter: true
-        });
+        $('#flipbook').turn(__TURN_OPTIONS__);
         // Add visible edges
         $('<div class=\"edge-indicator left\"></div>').appendTo('#flipbook');
         $('<div class=\"edge-indicator right\"></div>').appendTo('#flipbook');
       });
     """
 
-    html = f"""
-<!DOCTYPE html>
-<html lang=\"en\">
-<head>
-<meta charset=\"utf-8\" />
-<meta name=\"viewport\" content=\"width=device-width, initial-scale=1, maximum-scale=1, viewport-fit=cover\" />
-<title>Flipbook</title>
-<style>{css}</style>
-<script>{JQUERY_MIN}</script>
-<script>{TURNJS_MIN}</script>
-</head>
-<body>
-<div id=\"app\">
-  <div id=\"flipbook\">
-    {pages_str}
-  </div>
-</div>
-<script>{security_js}</script>
-<script>{init_js}</script>
-</body>
-</html>
-"""
-    return html
-
-
-@app.post("/api/convert", response_class=Response)
-async def convert_pdf_to_flipbook(
-    pdf: UploadFile = File(...),
-    password: str = Form("")
-):
-    if not pdf.filename.lower().endswith('.pdf'):
+
+# Filled in per flipbook, in document order
+_TAIL_PLACEHOLDERS = ("__PASS__", "__LAZY_SCRIPT__", "__TURN_OPTIONS__")
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+
+
+def _minify_css(css: str) -> str:
+    """Drop comments and insignificant whitespace; spaces that separate selectors or values stay"""
+    css = " ".join(_CSS_COMMENT.sub("", css).split())
+    css = _CSS_PUNCTUATION.sub(r"\1", css).replace(": ", ":")
+    return css.replace(";}", "}")
+
+
+def _minify_js(js: str) -> str:
+    """Strip indentation, blank lines and whole-line comments.
+
+    Line breaks are kept, so automatic semicolon insertion and the regex and
+    string literals inside lines are untouched.
+    """
+    lines = []
+    in_comment = False
+    for line in js.splitlines():
+        line = line.strip()
+        if in_comment or line.startswith("/*"):
+            in_comment = "*/" not in line
+            continue
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+# Lazy loader script, minified once; __LAZY_WINDOW__ is filled in per flipbook
+_LAZY_JS_MIN = _minify_js(LAZY_JS)
+
+
+def _compile_shell():
+    """Build the static flipbook shell once, minified: the head bytes and the tail split around its placeholders"""
+    head = (
+        '<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8"/>'
+        '<meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1, viewport-fit=cover"/>'
+        f"<title>Flipbook</title><style>{_minify_css(FLIPBOOK_CSS)}</style>"
+        f"<script>{_minify_js(JQUERY_MIN)}</script><script>{_minify_js(TURNJS_MIN)}</script>"
+        '</head><body><div id="app"><div id="flipbook">\n'
+    )
+    tail = (
+        f"</div></div><script>{_minify_js(SECURITY_JS)}</script>\n<script>{_minify_js(DEDUP_JS)}</script>\n"
+        f"__LAZY_SCRIPT__<script>{_minify_js(INIT_JS)}</script></body></html>\n"
+    )
+    parts = []
+    for placeholder in _TAIL_PLACEHOLDERS:
+        before, tail = tail.split(placeholder)
+        parts.append(before.encode("utf-8"))
+    parts.append(tail.encode("utf-8"))
+    return head.encode("utf-8"), tuple(parts)
+
+
+# Precompiled at import; per flipbook only the password and turn() options are filled in
+FLIPBOOK_HEAD, _FLIPBOOK_TAIL_PARTS = _compile_shell()
+
+# The head compressed once per content coding, continued by each compressed response
+_COMPRESSED_HEAD = CompressedPrefix(FLIPBOOK_HEAD)
+
+
+# Rendered width of a page image: 92vw in portrait, 90vh / 1.414 in landscape
+PAGE_IMAGE_SIZES = "(orientation: portrait) 92vw, 64vh"
+
+
+def _flipbook_page(idx: int, data_url: str, srcset: str = "", lazy: bool = False) -> str:
+    if srcset:
+        img = f'<img src="{data_url}" srcset="{srcset}" sizes="{PAGE_IMAGE_SIZES}" alt="Page {idx+1}"/>'
+    else:
+        img = f'<img src="{data_url}" alt="Page {idx+1}"/>'
+    if lazy:
+        img = f"<template>{img}</template>"
+    return f'    <div class="page">{img}</div>\n'
+
+
+# Start of the payload of a page that repeats an earlier one, followed by that page's position
+_PAGE_REF_PREFIX = b'    <div class="page" data-same="'
+
+
+def _page_ref(original: int) -> List[bytes]:
+    """Payload of a page identical to the page at position original: no image, DEDUP_JS copies it in"""
+    return [_PAGE_REF_PREFIX + f'{original}"></div>\n'.encode("ascii")]
+
+
+def _referenced_page(payload: List[bytes]) -> Optional[int]:
+    """Position of the page a _page_ref payload repeats, None for any other payload"""
+    if len(payload) != 1 or not payload[0].startswith(_PAGE_REF_PREFIX):
+        return None
+    return int(payload[0][len(_PAGE_REF_PREFIX):].split(b'"', 1)[0])
+
+
+def _page_set_digest(images: List[bytes]) -> bytes:
+    digest = hashlib.sha256()
+    for img in images:
+        digest.update(len(img).to_bytes(8, "little"))
+        digest.update(img)
+    return digest.digest()
+
+
+# Placeholder for a data URL in page markup; _page_parts splices the encoded image in its place
+_URL_SLOT = re.compile(r"\x00(\d+)\x00")
+
+
+def _page_parts(
+    idx: int, images: List[bytes], widths: Tuple[int, ...], mime_type: str, lazy: bool = False
+) -> List[bytes]:
+    """One page <div> as a list of byte chunks; with several widths the renditions go into srcset, smallest as src.
+
+    The data URLs are never built as strings: each image is base64-encoded in
+    slices that go into the list as they are, so the page exists once, encoded.
+    SVG (vector) pages get their own MIME type whatever mime_type says.
+    """
+    # A capped photo page repeats its largest rendition, a vector page its SVG; list each image once
+    candidates = {}
+    for width, img in zip(widths, images):
+        candidates[img] = width
+    images = list(candidates)
+    if len(images) == 1:
+        markup = _flipbook_page(idx, "\x000\x00", lazy=lazy)
+    else:
+        srcset = ", ".join(f"\x00{n}\x00 {width}w" for n, width in enumerate(candidates.values()))
+        markup = _flipbook_page(idx, "\x000\x00", srcset, lazy=lazy)
+    urls = [[f"data:{image_mime_type(img, mime_type)};base64,".encode("ascii"), *_b64_chunks(img)] for img in images]
+    parts = []
+    for n, piece in enumerate(_URL_SLOT.split(markup)):
+        if n % 2:
+            parts += urls[int(piece)]
+        elif piece:
+            parts.append(piece.encode("ascii"))
+    return parts
+
+
+def _script_json(value) -> str:
+    """value as a JSON literal safe to inline in a <script> ("</script>" or "<!--" cannot end it)"""
+    return json.dumps(value, separators=(",", ":")).replace("<", "\\u003c")
+
+
+def _flipbook_tail(
+    password: str, turn_options: Optional[dict] = None, lazy_window: Optional[int] = None
+) -> bytes:
+    """Closes #flipbook and adds the password gate, lazy loader and turn.js init scripts"""
+    options = _script_json({**TURN_OPTIONS, **(turn_options or {})})
+    lazy_script = ""
+    if lazy_window is not None:
+        lazy_script = "<script>" + _LAZY_JS_MIN.replace("__LAZY_WINDOW__", str(lazy_window)) + "</script>\n"
+    values = (_script_json(password), lazy_script, options)
+    parts = [_FLIPBOOK_TAIL_PARTS[0]]
+    for value, part in zip(values, _FLIPBOOK_TAIL_PARTS[1:]):
+        parts += (value.encode("utf-8"), part)
+    return b"".join(parts)
+
+
+def _build_single_file_html(image_data_urls: List[str], password: str, turn_options: Optional[dict] = None) -> str:
+    pages_str = "".join(_flipbook_page(idx, data_url) for idx, data_url in enumerate(image_data_urls))
+    return FLIPBOOK_HEAD.decode("utf-8") + pages_str + _flipbook_tail(password, turn_options).decode("utf-8")
+
+
+def _iter_page_payloads(
+    source: PdfSource,
+    profile: RenderProfile = RenderProfile(),
+    codec: ImageCodec = ImageCodec(),
+    lazy: bool = False,
+    pages: Optional[PageRanges] = None,
+    previous: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+    dedup: Optional[DedupStats] = None,
+) -> Iterator[List[bytes]]:
+    """Encoded page <div> payloads, the stage between rendering and the HTML shell.
+
+    Each payload is a list of byte chunks (see _page_parts), passed on to the
+    response as they are; a page that renders identically to an earlier one
+    is only a reference to it (see _page_ref). Cached separately from the
+    rendered pages, so a new password or turn() config for a known document
+    reuses the payloads and only rebuilds the shell.
+    """
+    key = cache_key(source.sha256, *_render_ids(profile, codec, pages), "lazy" if lazy else "eager")
+    cached = payload_cache.get(key)
+    if cached is not None:
+        for payload in cached:
+            yield payload if isinstance(payload, list) else [payload]
+        return
+    page_sets = _iter_pdf_to_page_sets(
+        source, profile, codec=codec, pages=pages, previous=previous, timings=timings, dedup=dedup
+    )
+    yield from payload_cache.store(key, _page_payloads(page_sets, profile, codec, lazy, timings), fmt="html")
+
+
+def _page_payloads(
+    page_sets: Iterator[List[bytes]],
+    profile: RenderProfile,
+    codec: ImageCodec,
+    lazy: bool,
+    timings: Optional[StageTimings] = None,
+) -> Iterator[List[bytes]]:
+    """Encode each page set, sending pages whose images were already sent as references"""
+    # Page set digest -> position of the first page with it
+    seen: Dict[bytes, int] = {}
+    for idx, images in enumerate(page_sets):
+        start = time.perf_counter() if timings is not None else 0.0
+        original = seen.setdefault(_page_set_digest(images), idx)
+        if original != idx:
+            payload = _page_ref(original)
+        else:
+            payload = _page_parts(idx, images, profile.widths, codec.mime_type, lazy=lazy)
+        if timings is not None:
+            timings.add("base64", time.perf_counter() - start, sum(map(len, payload)))
+        yield payload
+
+
+def _iter_asset_payloads(
+    source: PdfSource,
+    profile: RenderProfile,
+    codec: ImageCodec,
+    base_url: str,
+    pages: Optional[PageRanges] = None,
+    previous: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+    dedup: Optional[DedupStats] = None,
+) -> Iterator[List[bytes]]:
+    """Split-output stage: publish the page images as assets, then yield page <div>s that load them by URL.
+
+    Assets live in the asset store under the conversion ID (the content-addressed
+    render key), so repeat conversions of the same document publish nothing new.
+    They are rendered straight into the asset store, not also into the page cache.
+    A page with the same fingerprint as an earlier one is a reference to it
+    (see _page_ref), so clients fetch its assets once.
+    """
+    conversion_id = _conversion_id(source, profile, codec, pages)
+    if asset_store.count(conversion_id) is None:
+        page_sets = _iter_pdf_to_page_sets(
+            source,
+            profile,
+            codec=codec,
+            pages=pages,
+            previous=previous,
+            timings=timings,
+            dedup=dedup,
+            cache=asset_store,
+        )
+        for _ in page_sets:
+            pass
+    count = asset_store.count(conversion_id)
+    if count is None:
+        raise HTTPException(status_code=500, detail="Rendered pages do not fit in the asset store.")
+
+    info = _document_info(source, timings)
+    indices = _select_pages(pages, info["page_count"]) if pages else range(info["page_count"])
+    duplicates = _duplicate_positions([info["pages"][i]["fingerprint"] for i in indices])
+    per_page = len(profile.widths)
+    prefix = f"{base_url}api/flipbooks/{conversion_id}/"
+    for idx in range(count // per_page):
+        if idx in duplicates:
+            yield _page_ref(duplicates[idx])
+            continue
+        urls = [f"{prefix}{idx * per_page + j}.{codec.fmt}" for j in range(per_page)]
+        srcset = ", ".join(f"{url} {width}w" for url, width in zip(urls, profile.widths)) if per_page > 1 else ""
+        yield [_flipbook_page(idx, urls[0], srcset, lazy=True).encode("ascii")]
+
+
+def _iter_flipbook_html(
+    pdf: Union[bytes, PdfSource],
+    password: str,
+    profile: RenderProfile = RenderProfile(),
+    turn_options: Optional[dict] = None,
+    codec: ImageCodec = ImageCodec(),
+    lazy_window: Optional[int] = None,
+    asset_base_url: Optional[str] = None,
+    on_page: Optional[Callable[[], None]] = None,
+    pages: Optional[PageRanges] = None,
+    previous: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+) -> Iterator[bytes]:
+    """Blocking conversion pipeline as a generator.
+
+    Yields the HTML head, then each rendered page's <div> in chunks (the
+    page's base64 slices as encoded), then the tail, so only the page being
+    encoded is held in memory. The document ends with an HTML comment
+    reporting the page count and output size. With a lazy_window, pages are
+    emitted inert and decoded only near the current page.
+
+    With an asset_base_url the output is split: pages are published as assets
+    and the HTML is a small shell that lazily fetches them from that server.
+
+    pages limits the flipbook to those 1-based (first, last) page ranges. With
+    a previous conversion ID, only pages that changed since that conversion
+    are rendered; the rest reuse its images.
+
+    Pages identical to an earlier page are sent as references to it and not
+    rendered again; the report counts them with the bytes and renders saved.
+
+    on_page, if given, is called as each page is produced (for job progress).
+    timings, if given, collects per-stage times; their summary joins the report.
+    """
+    source = as_pdf_source(pdf)
+    dedup = DedupStats()
+    if asset_base_url is not None:
+        if lazy_window is None:
+            lazy_window = DEFAULT_LAZY_WINDOW
+        payloads = _iter_asset_payloads(source, profile, codec, asset_base_url, pages, previous, timings, dedup)
+    else:
+        payloads = _iter_page_payloads(
+            source,
+            profile,
+            codec=codec,
+            lazy=lazy_window is not None,
+            pages=pages,
+            previous=previous,
+            timings=timings,
+            dedup=dedup,
+        )
+    try:
+        # Render the first page before anything is sent so broken PDFs still get a 500
+        first_payload = next(payloads, None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render PDF: {e}")
+
+    # Payload size per page, for the bytes each reference saved
+    sizes: List[int] = []
+
+    def account(payload: List[bytes]):
+        size = sum(map(len, payload))
+        original = _referenced_page(payload)
+        if original is not None:
+            dedup.pages += 1
+            dedup.bytes += sizes[original] - size
+        sizes.append(size)
+        if on_page is not None:
+            on_page()
+
+    yield FLIPBOOK_HEAD
+    if first_payload is not None:
+        account(first_payload)
+        yield from first_payload
+        first_payload = None
+    for payload in payloads:
+        account(payload)
+        yield from payload
+    page_count, page_bytes = len(sizes), sum(sizes)
+    start = time.perf_counter() if timings is not None else 0.0
+    tail = _flipbook_tail(password, turn_options, lazy_window)
+    if timings is not None:
+        timings.add("assemble", time.perf_counter() - start, len(FLIPBOOK_HEAD) + len(tail))
+    yield tail
+    total_bytes = len(FLIPBOOK_HEAD) + page_bytes + len(tail)
+    stages = f"stages={timings.summary()} " if timings is not None else ""
+    yield (
+        f"<!-- flipbook conversion={_conversion_id(source, profile, codec, pages)} "
+        f"pages={page_count} format={codec.fmt} output={'split' if asset_base_url else 'single'} "
+        f"page_bytes={page_bytes} total_bytes={total_bytes} "
+        f"duplicate_pages={dedup.pages} saved_bytes={dedup.bytes} saved_renders={dedup.renders} {stages}-->\n"
+    ).encode("ascii")
+
+
+def _parse_turn_options(raw: str) -> Optional[dict]:
+    """Validate the optional JSON turn() overrides sent with a conversion"""
+    if not raw:
+        return None
+    try:
+        options = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="turn_options must be a JSON object.")
+    if not isinstance(options, dict):
+        raise HTTPException(status_code=400, detail="turn_options must be a JSON object.")
+    unknown = set(options) - set(TURN_OPTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown turn_options: {', '.join(sorted(unknown))}")
+    for name, value in options.items():
+        expected = type(TURN_OPTIONS[name])
+        if type(value) is not expected or (expected is int and value <= 0):
+            kind = {int: "a positive integer", bool: "true or false", str: "a string"}[expected]
+            raise HTTPException(status_code=400, detail=f"turn_options.{name} must be {kind}.")
+    if options.get("display", "single") not in TURN_DISPLAYS:
+        raise HTTPException(status_code=400, detail=f"turn_options.display must be one of: {', '.join(TURN_DISPLAYS)}")
+    return options
+
+
+def _parse_image_codec(image_format: str, quality: int, max_page_bytes: int) -> ImageCodec:
+    """Validate the output image settings sent with a conversion"""
+    fmt = image_format.lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of: {', '.join(IMAGE_FORMATS)}")
+    if fmt == "webp" and not webp_available():
+        raise HTTPException(status_code=400, detail="WebP output is not available on this server (needs Pillow with WebP).")
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100.")
+    if max_page_bytes < 0:
+        raise HTTPException(status_code=400, detail="max_page_bytes must not be negative.")
+    return ImageCodec(fmt, quality, max_page_bytes)
+
+
+def _parse_render_profile(device: str, widths: str) -> RenderProfile:
+    """Pick the render sizes: a device target, explicit widths, or the 900px default"""
+    if device and widths:
+        raise HTTPException(status_code=400, detail="Send either device or widths, not both.")
+    if device:
+        profile = DEVICE_PROFILES.get(device.lower())
+        if profile is None:
+            raise HTTPException(status_code=400, detail=f"device must be one of: {', '.join(DEVICE_PROFILES)}")
+        return profile
+    if widths:
+        try:
+            parsed = sorted({int(width) for width in widths.split(",") if width.strip()})
+        except ValueError:
+            raise HTTPException(status_code=400, detail="widths must be a comma-separated list of integers.")
+        if not parsed or len(parsed) > MAX_RENDER_WIDTHS:
+            raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_RENDER_WIDTHS} widths.")
+        if parsed[0] < MIN_RENDER_WIDTH or parsed[-1] > MAX_RENDER_WIDTH:
+            raise HTTPException(
+                status_code=400, detail=f"widths must be between {MIN_RENDER_WIDTH} and {MAX_RENDER_WIDTH} pixels."
+            )
+        return RenderProfile(tuple(parsed))
+    return RenderProfile()
+
+
+def _parse_page_ranges(spec: str) -> Optional[PageRanges]:
+    """Parse a 1-based page selection like "1-5,8,10-" into (first, last) ranges, last None meaning the end"""
+    if not spec.strip():
+        return None
+    invalid = HTTPException(status_code=400, detail="pages must list page numbers and ranges, like 1-5,8,10-.")
+    ranges = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        first, dash, last = (value.strip() for value in part.partition("-"))
+        try:
+            first = int(first) if first else 1
+            last = (int(last) if last else None) if dash else first
+        except ValueError:
+            raise invalid
+        if first < 1 or (last is not None and last < first):
+            raise invalid
+        ranges.append((first, last))
+    if not ranges:
+        raise invalid
+    if len(ranges) > MAX_PAGE_RANGES:
+        raise HTTPException(status_code=400, detail=f"Send at most {MAX_PAGE_RANGES} page ranges.")
+    return tuple(ranges)
+
+
+def _parse_previous(previous: str, profile: RenderProfile, codec: ImageCodec) -> Optional[str]:
+    """Validate the conversion ID an incremental conversion builds on"""
+    if not previous:
+        return None
+    if not CONVERSION_ID.fullmatch(previous):
+        raise HTTPException(status_code=400, detail="previous must be a conversion ID.")
+    settings = "-".join(_render_ids(profile, codec))
+    render_ids = previous[65:]
+    if render_ids != settings and not render_ids.startswith(settings + "-pg"):
+        raise HTTPException(
+            status_code=400, detail="previous was converted with different image settings; its pages cannot be reused."
+        )
+    return previous
+
+
+async def _prepend(first, rest: AsyncIterator):
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+def _int_field(fields: Dict[str, str], name: str, default: int) -> int:
+    value = fields.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer.")
+
+
+def _bool_field(fields: Dict[str, str], name: str) -> bool:
+    value = fields.get(name, "").strip().lower()
+    if value in ("", "0", "false", "off", "no"):
+        return False
+    if value in ("1", "true", "on", "yes"):
+        return True
+    raise HTTPException(status_code=400, detail=f"{name} must be a boolean.")
+
+
+def _conversion_options(request: Request, fields: Dict[str, str]) -> dict:
+    """Form fields shared by /api/convert and /api/jobs, validated into _iter_flipbook_html arguments"""
+    options = _parse_turn_options(fields.get("turn_options", ""))
+    codec = _parse_image_codec(
+        fields.get("image_format") or "png",
+        _int_field(fields, "quality", DEFAULT_QUALITY),
+        _int_field(fields, "max_page_bytes", 0),
+    )
+    profile = _parse_render_profile(fields.get("device", ""), fields.get("widths", ""))
+    if _bool_field(fields, "vector"):
+        profile = profile._replace(vector=True)
+    lazy_window = _int_field(fields, "lazy_window", DEFAULT_LAZY_WINDOW)
+    if not 0 <= lazy_window <= MAX_LAZY_WINDOW:
+        raise HTTPException(status_code=400, detail=f"lazy_window must be between 0 and {MAX_LAZY_WINDOW}.")
+    pages = _parse_page_ranges(fields.get("pages", ""))
+    previous = _parse_previous(fields.get("previous", ""), profile, codec)
+    output = fields.get("output") or "single"
+    if output not in ("single", "split"):
+        raise HTTPException(status_code=400, detail="output must be 'single' or 'split'.")
+    if output == "split" and not asset_store.enabled:
+        raise HTTPException(status_code=400, detail="Split output is disabled on this server.")
+    return {
+        "password": fields.get("password", ""),
+        "profile": profile,
+        "turn_options": options,
+        "codec": codec,
+        "lazy_window": lazy_window if _bool_field(fields, "lazy") or output == "split" else None,
+        "asset_base_url": (PUBLIC_BASE_URL or str(request.base_url)) if output == "split" else None,
+        "pages": pages,
+        "previous": previous,
+    }
+
+
+def _flipbook_filename(upload_name: str) -> str:
+    if not upload_name.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Please upload a PDF file.")
-    content = await pdf.read()
+    return os.path.splitext(os.path.basename(upload_name))[0] + "_flipbook.html"
+
+
+async def _conversion_upload(request: Request) -> Tuple[PdfSource, str, dict]:
+    """Stream the uploaded PDF to memory or disk and validate the conversion form fields.
+
+    The body is read here rather than by FastAPI's File()/Form() parameters so
+    oversized or non-PDF uploads are refused before they are fully received.
+    """
+    timings = new_timings()
+    try:
+        upload = await receive_pdf_upload(request)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if timings is not None:
+        timings.add("upload", timings.elapsed(), upload.source.size)
     try:
-        images = _render_pdf_to_images(content, target_width=900)
+        filename = _flipbook_filename(upload.filename)
+        options = _conversion_options(request, upload.fields)
+    except HTTPException:
+        upload.source.close()
+        raise
+    options["timings"] = timings
+    return upload.source, filename, options
+
+
+# Documents the multipart form read by _conversion_upload, for /docs
+_CONVERSION_FORM_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["pdf"],
+                    "properties": {
+                        "pdf": {"type": "string", "format": "binary"},
+                        "password": {"type": "string", "default": ""},
+                        "turn_options": {"type": "string", "default": ""},
+                        "image_format": {"type": "string", "default": "png", "enum": list(IMAGE_FORMATS)},
+                        "quality": {"type": "integer", "default": DEFAULT_QUALITY},
+                        "max_page_bytes": {"type": "integer", "default": 0},
+                        "device": {"type": "string", "default": ""},
+                        "widths": {"type": "string", "default": ""},
+                        "vector": {"type": "boolean", "default": False},
+                        "lazy": {"type": "boolean", "default": False},
+                        "lazy_window": {"type": "integer", "default": DEFAULT_LAZY_WINDOW},
+                        "output": {"type": "string", "default": "single", "enum": ["single", "split"]},
+                        "pages": {"type": "string", "default": "", "example": "1-5,8,10-"},
+                        "previous": {"type": "string", "default": ""},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def _closing(
+    source: PdfSource, items: Iterator[bytes], endpoint: str = "convert", timings: Optional[StageTimings] = None
+) -> Iterator[bytes]:
+    """Yield from items, then release the spooled upload and record the conversion once it ends"""
+    status = "error"
+    try:
+        yield from items
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    finally:
+        source.close()
+        if timings is not None:
+            metrics_registry.observe_conversion(endpoint, timings, status)
+
+
+@app.post("/api/convert", response_class=StreamingResponse, openapi_extra=_CONVERSION_FORM_OPENAPI)
+async def convert_pdf_to_flipbook(request: Request, upload: tuple = Depends(_conversion_upload)):
+    source, filename, options = upload
+    timings = options["timings"]
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    items = _closing(source, _iter_flipbook_html(source, **options), "convert", timings)
+    if encoding is not None:
+        # Compressed on the conversion thread, chunk by chunk as the pipeline yields
+        items = compress_stream(items, encoding, _COMPRESSED_HEAD, timings)
+    body = conversion_executor.stream(items)
+    try:
+        head = await body.__anext__()
+    except ConversionQueueFull:
+        source.close()
+        metrics_registry.observe_rejection("convert")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversions in progress. Please retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+
+    headers = {
+        "Content-Disposition": f"attachment; filename=\"{filename}\"",
+        "X-Conversion-Id": _conversion_id(source, options["profile"], options["codec"], options["pages"]),
+        "Vary": "Accept-Encoding",
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if SERVER_TIMING and timings is not None:
+        # Only the stages finished before the first byte: the body is still streaming
+        headers["Server-Timing"] = timings.server_timing()
+    return StreamingResponse(_prepend(head, body), media_type="text/html; charset=utf-8", headers=headers)
+
+
+def _build_preview(
+    source: PdfSource,
+    profile: RenderProfile,
+    codec: ImageCodec,
+    budget: float,
+    timings: Optional[StageTimings] = None,
+) -> Tuple[dict, Optional[Iterator[bytes]]]:
+    """Page 1 at flipbook size plus as much of the thumbnail strip as fits in budget seconds.
+
+    Returns the preview and, when the strip was cut short, the iterator that
+    renders the rest of it (and commits it to the page cache once drained).
+    Only page sizes are read, not fingerprints, so parsing stays a small part
+    of the budget.
+    """
+    deadline = time.monotonic() + budget
+    try:
+        start = time.perf_counter()
+        info = document_info(source.document, fingerprints=False)
+        if timings is not None:
+            timings.add("parse", time.perf_counter() - start)
+        if not info["page_count"]:
+            raise HTTPException(status_code=400, detail="The PDF has no pages.")
+        first_page = next(
+            iter_pdf_page_sets(source.document, profile, workers=1, codec=codec, pages=[0], timings=timings)
+        )
+        thumbnails = []
+        strip = _iter_thumbnails(source, timings)
+        for image in strip:
+            thumbnails.append(_b64_image(image, THUMBNAIL_CODEC.mime_type))
+            if time.monotonic() >= deadline:
+                break
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to render PDF: {e}")
 
-    image_urls = [_b64_png(img) for img in images]
-    html = _build_single_file_html(image_urls, password)
-    filename = os.path.splitext(os.path.basename(pdf.filename))[0] + "_flipbook.html"
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return Response(content=html, media_type="text/html; charset=utf-8", headers=headers)
+    complete = len(thumbnails) == info["page_count"]
+    preview_id = _conversion_id(source, THUMBNAIL_PROFILE, THUMBNAIL_CODEC)
+    preview = {
+        "page_count": info["page_count"],
+        "pages": [{"width": page["width"], "height": page["height"]} for page in info["pages"]],
+        "first_page": _b64_image(first_page[-1], image_mime_type(first_page[-1], codec.mime_type)),
+        "thumbnail_width": THUMBNAIL_PROFILE.widths[0],
+        "thumbnails": thumbnails,
+        "thumbnails_complete": complete,
+        "thumbnails_url": f"/api/previews/{preview_id}/thumbnails",
+    }
+    return preview, None if complete else strip
+
+
+def _iter_thumbnails(source: PdfSource, timings: Optional[StageTimings] = None) -> Iterator[bytes]:
+    """The thumbnail strip, one image per page, kept in the page cache under the preview ID.
+
+    Unlike conversions, repeated pages are not detected: at thumbnail size
+    rendering them again is cheaper than fingerprinting the document.
+    """
+    preview_id = _conversion_id(source, THUMBNAIL_PROFILE, THUMBNAIL_CODEC)
+    images = conversion_cache.get(preview_id)
+    if images is None:
+        page_sets = iter_pdf_page_sets(source.document, THUMBNAIL_PROFILE, codec=THUMBNAIL_CODEC, timings=timings)
+        images = conversion_cache.store(preview_id, (page_set[0] for page_set in page_sets), fmt=THUMBNAIL_CODEC.fmt)
+    yield from images
+
+
+def _drain_thumbnails(source: PdfSource, strip: Iterator[bytes]):
+    """Background: render the rest of a thumbnail strip so it lands in the page cache"""
+    try:
+        for _ in strip:
+            pass
+    finally:
+        source.close()
+
+
+def _discard_thumbnails(source: PdfSource, strip: Iterator[bytes]):
+    strip.close()
+    source.close()
+
+
+async def _run_backfill(source: PdfSource, strip: Iterator[bytes]):
+    try:
+        await conversion_executor.run(_drain_thumbnails, source, strip)
+    except ConversionQueueFull:
+        _discard_thumbnails(source, strip)
+    except Exception:
+        # The strip is not cached; its thumbnails_url keeps answering 404
+        pass
+
+
+def _backfill_thumbnails(source: PdfSource, strip: Iterator[bytes]):
+    """Finish a cut-short thumbnail strip in the background, holding a conversion executor slot.
+
+    Dropped, leaving the strip incomplete, while PREVIEW_MAX_BACKFILLS are
+    pending or the executor has no queue position free: backfills count
+    against the conversion limits and never hold uploads in an unbounded queue.
+    """
+    if len(_preview_backfills) >= PREVIEW_MAX_BACKFILLS:
+        _discard_thumbnails(source, strip)
+        return
+    task = asyncio.ensure_future(_run_backfill(source, strip))
+    _preview_backfills.add(task)
+    task.add_done_callback(_preview_backfills.discard)
+
+
+@app.post("/api/preview", openapi_extra=_CONVERSION_FORM_OPENAPI)
+async def preview_pdf(response: Response, upload: tuple = Depends(_conversion_upload)):
+    """First page at flipbook size and a low-resolution thumbnail strip, within PREVIEW_TIME_BUDGET.
+
+    Thumbnails that miss the budget are finished in the background, when a
+    conversion slot is free, and can then be fetched from thumbnails_url.
+    """
+    source, _, options = upload
+    timings = options["timings"]
+    rest = None
+    try:
+        preview, rest = await conversion_executor.run(
+            _build_preview, source, options["profile"], options["codec"], PREVIEW_TIME_BUDGET, timings
+        )
+    except ConversionQueueFull:
+        metrics_registry.observe_rejection("preview")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversions in progress. Please retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+    finally:
+        if rest is None:
+            source.close()
+        else:
+            _backfill_thumbnails(source, rest)
+    if timings is not None:
+        metrics_registry.observe_conversion("preview", timings, "ok")
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = timings.server_timing()
+    return preview
+
+
+@app.get("/api/previews/{preview_id}/thumbnails")
+def get_preview_thumbnails(preview_id: str):
+    """The complete thumbnail strip of a preview, once it has been rendered"""
+    thumbnail_ids = "-".join(_render_ids(THUMBNAIL_PROFILE, THUMBNAIL_CODEC))
+    if not CONVERSION_ID.fullmatch(preview_id) or preview_id[65:] != thumbnail_ids:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    thumbnails = conversion_cache.get(preview_id)
+    if thumbnails is None:
+        raise HTTPException(status_code=404, detail="Thumbnails are not ready yet")
+    return {"thumbnails": [_b64_image(img, THUMBNAIL_CODEC.mime_type) for img in thumbnails]}
+
+
+def _run_conversion_job(output_file, report_progress, source: PdfSource, options: dict):
+    """JobManager runner: write the flipbook to output_file, reporting pages rendered"""
+    pages_done = 0
+
+    def on_page():
+        nonlocal pages_done
+        pages_done += 1
+        report_progress(pages_done, total_pages)
+
+    try:
+        page_count = _document_info(source, options["timings"])["page_count"]
+        total_pages = len(_select_pages(options["pages"], page_count)) if options["pages"] else page_count
+        report_progress(0, total_pages)
+        for chunk in _closing(source, _iter_flipbook_html(source, on_page=on_page, **options), "job", options["timings"]):
+            output_file.write(chunk)
+    finally:
+        source.close()
+
+
+# Background conversions for documents too large for one request
+conversion_jobs = JobManager(_run_conversion_job)
+
+
+def _job_status(job: dict) -> dict:
+    total_pages = job.get("total_pages")
+    pages_done = job.get("pages_done") or 0
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "filename": job.get("filename"),
+        "pages_done": pages_done,
+        "total_pages": total_pages,
+        "progress": round(pages_done / total_pages, 4) if total_pages else 0.0,
+        "error": job.get("error"),
+        "result_url": f"/api/jobs/{job['job_id']}/result" if job["status"] == DONE else None,
+    }
+
+
+def _get_job(job_id: str) -> dict:
+    job = conversion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/api/jobs", status_code=202, openapi_extra=_CONVERSION_FORM_OPENAPI)
+async def create_conversion_job(upload: tuple = Depends(_conversion_upload)):
+    """Queue a conversion and return its job ID immediately"""
+    source, filename, options = upload
+    try:
+        # The job store may be MongoDB: keep its round trips off the event loop
+        job_id = await run_in_threadpool(conversion_jobs.submit, filename, source, options)
+    except JobQueueFull:
+        source.close()
+        metrics_registry.observe_rejection("job")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversion jobs pending. Please retry shortly.",
+            headers={"Retry-After": "30"},
+        )
+    except Exception:
+        source.close()
+        raise
+    return _job_status(await run_in_threadpool(_get_job, job_id))
+
+
+@app.get("/api/jobs/{job_id}")
+def get_conversion_job(job_id: str):
+    """Job status with progress as pages rendered out of total"""
+    return _job_status(_get_job(job_id))
+
+
+@app.get("/api/jobs/{job_id}/result")
+def get_conversion_job_result(job_id: str):
+    job = _get_job(job_id)
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}, no result available")
+    path = conversion_jobs.result_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Job result no longer available")
+    return FileResponse(path, media_type="text/html; charset=utf-8", filename=job.get("filename"))
+
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_conversion_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = conversion_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
+
+
+def _parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range 'bytes=' Range header into an inclusive (start, end).
+
+    Returns None when the header should be ignored (multiple or malformed
+    ranges) and raises 416 when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+CONVERSION_ID = re.compile(r"[0-9a-f]{64}(-[0-9a-z]+)+")
+ASSET_NAME = re.compile(r"(\d{1,5})\.(png|jpeg|webp)")
+
+
+@app.get("/api/flipbooks/{conversion_id}/{asset}")
+def get_flipbook_asset(conversion_id: str, asset: str, request: Request):
+    """Serve one page image of a split-output flipbook.
+
+    Assets are content-addressed and never change, so they are served with an
+    immutable Cache-Control, a strong ETag (If-None-Match gives 304) and
+    single byte-range support.
+    """
+    match = ASSET_NAME.fullmatch(asset)
+    if not CONVERSION_ID.fullmatch(conversion_id) or not match:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    index, fmt = int(match.group(1)), match.group(2)
+    path = asset_store.path(conversion_id, index, fmt)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    etag = f'"{conversion_id}-{index}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    media_type = MIME_TYPES[fmt]
+    with open(path, "rb") as f:
+        media_type = image_mime_type(f.read(5), media_type)
+    if media_type == SVG_MIME_TYPE:
+        # Vector pages opened directly must not run anything
+        headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; img-src data:"
+    range_header = request.headers.get("range")
+    if range_header:
+        size = os.path.getsize(path)
+        byte_range = _parse_byte_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            with open(path, "rb") as f:
+                f.seek(start)
+                body = f.read(end - start + 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return Response(content=body, status_code=206, media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Multi-worker production server (see server.py). The workers import this module
+    # themselves, so hand the process over rather than keep this copy of the app loaded.
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")])
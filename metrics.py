@@ -0,0 +1,175 @@
+"""
+Conversion Metrics
+
+Per-stage timings and byte counts for each conversion, aggregated into
+Prometheus-style counters, gauges and histograms that main.py serves as text
+on /metrics.
+
+A conversion carries a StageTimings object through the pipeline; each stage
+(upload, parse, render, encode, svg, base64, assemble, compress) adds its
+elapsed time and output bytes to it. Render workers time their own pages and send
+the totals back with each chunk; those times add up across processes, so
+render and encode can exceed the conversion's wall time. When neither metrics nor
+Server-Timing are enabled no StageTimings is created and every stage skips
+measurement after a single None check.
+
+Configure with environment variables:
+- METRICS_ENABLED: record conversions and serve /metrics (default: off)
+- SERVER_TIMING: add a Server-Timing header with the stage totals known when
+  the response starts (default: off)
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes", "on")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes", "on")
+
+# Upper bounds in seconds: whole conversions, and single stages of one conversion
+CONVERSION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class StageTimings:
+    """Seconds, bytes and call counts per pipeline stage for one conversion"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # stage -> [seconds, bytes, calls]
+        self.stages: Dict[str, List[float]] = {}
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0):
+        totals = self.stages.setdefault(stage, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += nbytes
+        totals[2] += 1
+
+    def merge(self, totals: Dict[str, List[float]]):
+        """Add totals reported by a render worker"""
+        for stage, (seconds, nbytes, calls) in totals.items():
+            mine = self.stages.setdefault(stage, [0.0, 0, 0])
+            mine[0] += seconds
+            mine[1] += nbytes
+            mine[2] += calls
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one metric per stage, durations in milliseconds"""
+        parts = [f"{stage};dur={totals[0] * 1000:.1f}" for stage, totals in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> str:
+        """Compact stage=milliseconds list for logs and report comments"""
+        return ",".join(f"{stage}:{totals[0] * 1000:.0f}ms" for stage, totals in self.stages.items())
+
+
+def new_timings() -> Optional[StageTimings]:
+    """A StageTimings for a new conversion, or None when nothing would read it"""
+    return StageTimings() if METRICS_ENABLED or SERVER_TIMING else None
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # label -> (bucket counts, [sum, count])
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, label: str, value: float):
+        counts, total = self._series.setdefault(label, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+
+    def lines(self, name: str, label_name: str) -> List[str]:
+        out = []
+        for label, (counts, (total, count)) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f'{name}_bucket{{{label_name}="{label}",le="{le}"}} {cumulative}')
+            out.append(f'{name}_sum{{{label_name}="{label}"}} {total:.6f}')
+            out.append(f'{name}_count{{{label_name}="{label}"}} {count}')
+        return out
+
+
+class MetricsRegistry:
+    """Process-wide conversion metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conversions: Dict[Tuple[str, str], int] = {}
+        self._stage_seconds: Dict[str, float] = {}
+        self._stage_bytes: Dict[str, int] = {}
+        self._stage_calls: Dict[str, int] = {}
+        self._duration = Histogram(CONVERSION_BUCKETS)
+        self._stage_duration = Histogram(STAGE_BUCKETS)
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]):
+        """Register a gauge whose value is read at scrape time"""
+        self._gauges[name] = (help_text, read)
+
+    def observe_conversion(self, endpoint: str, timings: StageTimings, status: str):
+        if not METRICS_ENABLED:
+            return
+        elapsed = timings.elapsed()
+        with self._lock:
+            key = (endpoint, status)
+            self._conversions[key] = self._conversions.get(key, 0) + 1
+            if status == "ok":
+                self._duration.observe(endpoint, elapsed)
+            for stage, (seconds, nbytes, calls) in timings.stages.items():
+                self._stage_seconds[stage] = self._stage_seconds.get(stage, 0.0) + seconds
+                self._stage_bytes[stage] = self._stage_bytes.get(stage, 0) + nbytes
+                self._stage_calls[stage] = self._stage_calls.get(stage, 0) + calls
+                self._stage_duration.observe(stage, seconds)
+
+    def observe_rejection(self, endpoint: str):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            key = (endpoint, "rejected")
+            self._conversions[key] = self._conversions.get(key, 0) + 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP flipbook_conversions_total Conversions by endpoint and outcome.",
+            "# TYPE flipbook_conversions_total counter",
+        ]
+        with self._lock:
+            for (endpoint, status), count in sorted(self._conversions.items()):
+                lines.append(f'flipbook_conversions_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            for name, help_text, values in (
+                ("flipbook_stage_seconds_total", "Time spent per pipeline stage.", self._stage_seconds),
+                ("flipbook_stage_bytes_total", "Bytes produced per pipeline stage.", self._stage_bytes),
+                ("flipbook_stage_calls_total", "Timed operations per pipeline stage.", self._stage_calls),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for stage, value in sorted(values.items()):
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f'{name}{{stage="{stage}"}} {value}')
+            lines += [
+                "# HELP flipbook_conversion_duration_seconds Successful conversion latency, upload start to last byte.",
+                "# TYPE flipbook_conversion_duration_seconds histogram",
+            ]
+            lines += self._duration.lines("flipbook_conversion_duration_seconds", "endpoint")
+            lines += [
+                "# HELP flipbook_stage_duration_seconds Per-conversion time spent in each stage.",
+                "# TYPE flipbook_stage_duration_seconds histogram",
+            ]
+            lines += self._stage_duration.lines("flipbook_stage_duration_seconds", "stage")
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,185 @@
+"""
+Query Result Cache
+
+Optional in-process read-through cache for the database.py read helpers
+(get_documents and find_document). Entries are keyed on the collection and
+the whole query (filter, limit, projection, sort), expire after a TTL, and
+the least recently used are evicted beyond the entry and byte budgets.
+Results are kept BSON-encoded, so every hit returns fresh documents that
+callers are free to modify.
+
+The write helpers in database.py invalidate every cached entry of the
+collection they write to. Writes made directly through `db`, or by another
+process, are not seen: readers then get results up to the TTL old. Cache only
+collections for which that is acceptable (QUERY_CACHE_COLLECTIONS).
+
+Configure with environment variables:
+- QUERY_CACHE_TTL_SECONDS: lifetime of a cached result, 0 disables the cache
+  (default: 0)
+- QUERY_CACHE_MAX_ENTRIES: cached results kept (default: 1024)
+- QUERY_CACHE_MAX_BYTES: BSON bytes kept; larger results are not cached
+  (default: 64 MiB)
+- QUERY_CACHE_COLLECTIONS: comma-separated collections to cache, empty for
+  all (default: empty)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import bson
+
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", 0))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 1024))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+QUERY_CACHE_COLLECTIONS = frozenset(
+    name.strip() for name in os.getenv("QUERY_CACHE_COLLECTIONS", "").split(",") if name.strip()
+)
+
+# (collection, repr of the query)
+QueryKey = Tuple[str, str]
+
+
+class QueryCache:
+    """TTL + LRU cache of query results with per-collection invalidation"""
+
+    def __init__(
+        self,
+        ttl: float = QUERY_CACHE_TTL_SECONDS,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        collections: FrozenSet[str] = QUERY_CACHE_COLLECTIONS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.collections = collections
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # key -> (expires at, encoded documents, size), least recently used first
+        self._entries: "OrderedDict[QueryKey, Tuple[float, List[bytes], int]]" = OrderedDict()
+        self._keys: Dict[str, Set[QueryKey]] = {}
+        # Bumped on every write (the epoch on clearing everything), so a result
+        # fetched before a write is not stored after it
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        # collection -> [hits, misses]
+        self._lookups: Dict[str, List[int]] = {}
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def caches(self, collection: str) -> bool:
+        return self.enabled and (not self.collections or collection in self.collections)
+
+    @staticmethod
+    def key(collection: str, *query) -> QueryKey:
+        # repr is exact for the values filters hold (ObjectId, datetime, numbers of
+        # different types); queries that differ only in key order get separate entries
+        return collection, repr(query)
+
+    def generation(self, collection: str) -> Tuple[int, int]:
+        """Take before fetching; pass to put() so a concurrent write discards the result"""
+        with self._lock:
+            return self._epoch, self._generations.get(collection, 0)
+
+    def get(self, key: QueryKey, codec_options: bson.CodecOptions = bson.DEFAULT_CODEC_OPTIONS) -> Optional[List[dict]]:
+        """The cached documents of key, decoded afresh (as the driver would with codec_options), or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            counts = self._lookups.setdefault(key[0], [0, 0])
+            if entry is None:
+                self.misses += 1
+                counts[1] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            counts[0] += 1
+            encoded = entry[1]
+        return [bson.decode(data, codec_options) for data in encoded]
+
+    def put(self, key: QueryKey, documents: List[dict], generation: Tuple[int, int]):
+        try:
+            encoded = [bson.encode(doc) for doc in documents]
+        except (bson.errors.InvalidDocument, TypeError):
+            return
+        size = sum(map(len, encoded))
+        if size > self.max_bytes:
+            return
+        collection = key[0]
+        with self._lock:
+            if (self._epoch, self._generations.get(collection, 0)) != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (self.clock() + self.ttl, encoded, size)
+            self._keys.setdefault(collection, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, collection: Optional[str] = None):
+        """Forget the results of one collection (all collections when None)"""
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+                self._keys.clear()
+                self._bytes = 0
+                self._epoch += 1
+            else:
+                for key in self._keys.pop(collection, ()):
+                    self._drop(key, forget=False)
+                self._generations[collection] = self._generations.get(collection, 0) + 1
+            self.invalidations += 1
+
+    def _drop(self, key: QueryKey, forget: bool = True):
+        """Remove one entry (lock held)"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        if forget:
+            keys = self._keys.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[key[0]]
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "ttl_seconds": self.ttl,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "collections": sorted(self.collections),
+                "by_collection": {
+                    name: {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 4)}
+                    for name, (hits, misses) in sorted(self._lookups.items())
+                },
+            }
@@ -0,0 +1,452 @@
+"""
+PDF Page Rendering
+
+Renders PDF pages to image bytes (PNG unless another ImageCodec is given) with
+PyMuPDF (fitz). Large documents are split into page chunks and rendered on a
+process pool so every core is used; small documents are rendered inline to
+avoid the pool round trip.
+
+Documents are given as bytes or as the path of a PDF file. Workers open the
+document from that file (or a temporary copy of the bytes) which all
+processes share through the OS page cache, so the bytes are never pickled
+per task. Each worker keeps the document it last opened until a different
+conversion arrives.
+
+A RenderProfile lists the widths each page is rendered at (for srcset). A
+page is rasterised once at the largest width and the smaller sizes are
+downscaled from that pixmap. Pages dominated by images can be capped at a
+lower width, since photos gain little from extra pixels while text does.
+With vector set, text and drawing pages are also exported as SVG, and the SVG
+replaces the raster renditions whenever it is smaller than the largest one.
+
+A subset of pages can be rendered by passing their indices. page_fingerprint
+hashes what a page draws, so callers can tell which pages of an updated
+document actually changed.
+
+Configure with environment variables:
+- RENDER_WORKERS: number of worker processes (default: CPU count, 1 disables the pool)
+- RENDER_CHUNK_SIZE: pages rendered per worker task (default: 8)
+
+Worker processes are started on first use, or up front by warm_render_pool().
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from image_codecs import ImageCodec, encode_pixmap
+
+RENDER_WORKERS = max(1, int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1)))
+RENDER_CHUNK_SIZE = max(1, int(os.getenv("RENDER_CHUNK_SIZE", 8)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+# Released once by each worker process when it has loaded PyMuPDF
+_pool_ready = None
+_pool_lock = threading.Lock()
+
+# Share of the page area covered by images above which a page counts as a photo page
+PHOTO_PAGE_COVERAGE = 0.6
+
+
+class RenderProfile(NamedTuple):
+    """Widths each page is rendered at, smallest first"""
+
+    widths: Tuple[int, ...] = (900,)
+    # Image-dominated pages are not rendered wider than this, 0 for no cap
+    photo_max_width: int = 0
+    # Emit non-photo pages as SVG when that is smaller than their raster renditions
+    vector: bool = False
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies the rendered sizes in cache keys"""
+        cap = f"-p{self.photo_max_width}" if self.photo_max_width else ""
+        return "w" + "-".join(str(width) for width in self.widths) + cap + ("-svg" if self.vector else "")
+
+
+# Device targets: 1x and high-DPI widths for the flipbook's on-screen size
+DEVICE_PROFILES = {
+    "phone": RenderProfile((400, 800), photo_max_width=600),
+    "tablet": RenderProfile((700, 1400), photo_max_width=1000),
+    "desktop": RenderProfile((900, 1800), photo_max_width=1200),
+}
+
+# Worker-process state: the document currently open in this worker
+_worker_doc = None
+_worker_doc_token = None
+
+
+def render_page(page, target_width: int, codec: ImageCodec = ImageCodec()) -> bytes:
+    """Render a single fitz page scaled to target_width pixels, encoded with codec"""
+    import fitz  # PyMuPDF
+
+    zoom = target_width / page.rect.width
+    mat = fitz.Matrix(zoom, zoom)
+    pix = page.get_pixmap(matrix=mat, alpha=False)
+    return encode_pixmap(pix, codec)
+
+
+def _is_photo_page(page) -> bool:
+    """True when images cover most of the page"""
+    page_area = abs(page.rect)
+    if not page_area:
+        return False
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(page.rect & info["bbox"])
+    return covered / page_area >= PHOTO_PAGE_COVERAGE
+
+
+def render_page_svg(page) -> bytes:
+    """Export a fitz page as an SVG document.
+
+    Text stays text when the page only uses fonts the PDF does not embed (the
+    standard 14), which browsers substitute as any PDF viewer would; embedded
+    fonts are drawn as glyph outlines so the page looks the same everywhere.
+    """
+    embedded = any(font[1] != "n/a" for font in page.get_fonts())
+    return page.get_svg_image(text_as_path=embedded).encode("utf-8")
+
+
+def render_page_set(page, profile: RenderProfile, codec: ImageCodec = ImageCodec(), timings=None) -> List[bytes]:
+    """Render a page once at the profile's largest width and encode every width from it.
+
+    Returns one image per profile width. Widths above a photo page's cap share
+    the capped rendition (the same bytes object). For a vector profile, a
+    non-photo page whose SVG is smaller than its largest rendition is returned
+    as that SVG for every width. timings, a metrics.StageTimings, receives the
+    render, encode and svg times when given.
+    """
+    import fitz  # PyMuPDF
+
+    top = max(profile.widths)
+    capped = profile.photo_max_width and top > profile.photo_max_width
+    photo = _is_photo_page(page) if capped or profile.vector else False
+    svg = None
+    if profile.vector and not photo:
+        start = time.perf_counter() if timings is not None else 0.0
+        svg = render_page_svg(page)
+        if timings is not None:
+            timings.add("svg", time.perf_counter() - start, len(svg))
+
+    start = time.perf_counter() if timings is not None else 0.0
+    if capped and photo:
+        top = profile.photo_max_width
+    zoom = top / page.rect.width
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    if timings is not None:
+        timings.add("render", time.perf_counter() - start, pix.stride * pix.height)
+
+    renditions = {}
+    images = []
+    for width in profile.widths:
+        width = min(width, top)
+        if width not in renditions:
+            start = time.perf_counter() if timings is not None else 0.0
+            if width == top:
+                scaled = pix
+            else:
+                scaled = fitz.Pixmap(pix, width, max(1, round(pix.height * width / pix.width)), None)
+            renditions[width] = encode_pixmap(scaled, codec)
+            if timings is not None:
+                timings.add("encode", time.perf_counter() - start, len(renditions[width]))
+        images.append(renditions[width])
+    if svg is not None and len(svg) < max(len(image) for image in images):
+        return [svg] * len(images)
+    return images
+
+
+def open_pdf(pdf: Union[bytes, str]):
+    """Open PDF bytes, or a PDF file by path, with PyMuPDF"""
+    import fitz  # PyMuPDF
+
+    if isinstance(pdf, str):
+        return fitz.open(pdf, filetype="pdf")
+    return fitz.open(stream=pdf, filetype="pdf")
+
+
+# Changes whenever page_fingerprint hashes something new, so stored fingerprints are not compared across versions
+FINGERPRINT_VERSION = "fp2"
+
+_REFERENCE = re.compile(r"\b(\d+) \d+ R\b")
+
+
+def _object_digest(doc, xref: int, cache: Dict[int, bytes], active: set) -> bytes:
+    """Digest of an object and everything it references, by content: references are replaced by their targets' digests"""
+    if xref in cache:
+        return cache[xref]
+    if xref in active:
+        # A reference cycle: the object is already being hashed further up
+        return b"cycle"
+    active.add(xref)
+    try:
+        source = doc.xref_object(xref, compressed=True)
+        stream = doc.xref_stream_raw(xref) if doc.xref_is_stream(xref) else b""
+    except Exception:
+        source, stream = "", b""
+    h = hashlib.sha256(_resolved_digest(doc, source, cache, active))
+    h.update(stream or b"")
+    active.discard(xref)
+    cache[xref] = h.digest()
+    return cache[xref]
+
+
+def _resolved_digest(doc, source: str, cache: Dict[int, bytes], active: set) -> bytes:
+    """Digest of PDF object source text with each reference replaced by the digest of its target"""
+    h = hashlib.sha256()
+    pos = 0
+    for match in _REFERENCE.finditer(source):
+        h.update(source[pos:match.start()].encode())
+        h.update(_object_digest(doc, int(match.group(1)), cache, active))
+        pos = match.end()
+    h.update(source[pos:].encode())
+    return h.digest()
+
+
+def _page_resources(doc, xref: int) -> Tuple[str, str]:
+    """The page's /Resources entry (kind, value), inherited from the page tree when the page has none"""
+    while xref:
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return kind, value
+        kind, value = doc.xref_get_key(xref, "Parent")
+        xref = int(value.split()[0]) if kind == "xref" else 0
+    return "null", ""
+
+
+def page_fingerprint(page, xref_digests: Optional[Dict[int, bytes]] = None) -> str:
+    """Hash of everything that affects how a page renders.
+
+    Covers the page geometry, its content stream, the whole /Resources tree
+    (graphics states, colour spaces, patterns, shadings, images, form XObjects
+    with their own resources, fonts with their embedded programs) and the
+    annotations with their appearance streams. Referenced objects are hashed
+    by their data rather than their xref numbers, which change when a document
+    is rewritten. xref_digests caches object digests across pages of one
+    document.
+    """
+    doc = page.parent
+    cache = {} if xref_digests is None else xref_digests
+    active = set()
+
+    h = hashlib.sha256(FINGERPRINT_VERSION.encode())
+    h.update(repr((tuple(page.rect), tuple(page.mediabox), page.rotation)).encode())
+    if page.get_contents():
+        h.update(page.read_contents())
+    kind, value = _page_resources(doc, page.xref)
+    h.update(kind.encode() + _resolved_digest(doc, value, cache, active))
+    for annot in page.annots():
+        h.update(repr((annot.type, tuple(annot.rect), annot.info, annot.colors, annot.flags)).encode())
+        kind, value = doc.xref_get_key(annot.xref, "AP/N")
+        if kind in ("xref", "dict"):
+            h.update(_resolved_digest(doc, value, cache, active))
+    return h.hexdigest()
+
+
+def document_info(pdf: Union[bytes, str], fingerprints: bool = True) -> dict:
+    """Page count and per-page size (in points) and, unless fingerprints is False, fingerprint of a PDF"""
+    with open_pdf(pdf) as doc:
+        digests = {}
+        pages = []
+        for page in doc:
+            info = {"width": round(page.rect.width, 2), "height": round(page.rect.height, 2)}
+            if fingerprints:
+                info["fingerprint"] = page_fingerprint(page, digests)
+            pages.append(info)
+    return {"page_count": len(pages), "pages": pages}
+
+
+def _open_worker_doc(path: str, token: str):
+    """Open (or reuse) the shared document inside a worker process"""
+    global _worker_doc, _worker_doc_token
+    if _worker_doc_token != token:
+        import fitz  # PyMuPDF
+
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(path, filetype="pdf")
+        _worker_doc_token = token
+    return _worker_doc
+
+
+def _render_chunk(
+    path: str, token: str, indices: Sequence[int], profile: RenderProfile, codec: ImageCodec, timed: bool = False
+) -> Tuple[List[List[bytes]], Optional[dict]]:
+    """Worker task: render the given pages of the shared document.
+
+    Returns the page images and, when timed, the worker's stage totals.
+    """
+    timings = None
+    if timed:
+        from metrics import StageTimings
+
+        timings = StageTimings()
+    doc = _open_worker_doc(path, token)
+    pages = [render_page_set(doc[i], profile, codec, timings) for i in indices]
+    return pages, timings.stages if timings is not None else None
+
+
+def _init_worker(ready):
+    import fitz  # noqa: F401  # PyMuPDF, loaded as the worker starts rather than by its first task
+
+    ready.release()
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers, _pool_ready
+    with _pool_lock:
+        # A worker that died (e.g. OOM-killed) breaks the whole executor; start a fresh one
+        if _pool is None or _pool_workers != workers or getattr(_pool, "_broken", False):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            context = get_context("spawn")
+            _pool_ready = context.Semaphore(0)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(_pool_ready,)
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def warm_render_pool(workers: Optional[int] = None, timeout: float = 60.0) -> int:
+    """Start every render worker now and wait until each has loaded PyMuPDF.
+
+    Workers are otherwise spawned by the first documents large enough to
+    need them, which then wait for the processes to start. Returns the number
+    of workers that became ready within timeout (0 when the pool is disabled).
+    """
+    workers = RENDER_WORKERS if workers is None else max(1, workers)
+    if workers == 1:
+        return 0
+    pool = _get_pool(workers)
+    with _pool_lock:
+        ready = _pool_ready
+    # Spawn-context pools start a process per submitted task until all workers are running
+    for _ in range(workers):
+        pool.submit(_worker_pid)
+    deadline = time.monotonic() + timeout
+    started = 0
+    while started < workers and ready.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        started += 1
+    return started
+
+
+def shutdown_render_pool():
+    """Stop the worker processes (called on application shutdown)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+
+def iter_pdf_page_sets(
+    pdf: Union[bytes, str],
+    profile: RenderProfile = RenderProfile(),
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    codec: ImageCodec = ImageCodec(),
+    pages: Optional[Sequence[int]] = None,
+    timings=None,
+) -> Iterator[List[bytes]]:
+    """Yield the encoded images (one per profile width) of every page of a PDF, in page order.
+
+    pdf is the document bytes or the path of a PDF file; a path is shared with
+    the workers as is, bytes are first written to a temporary file. pages
+    restricts rendering to those 0-based page indices, in the order given.
+    timings (a metrics.StageTimings) collects parse, render and encode times,
+    including those measured inside the workers.
+
+    Pages are split into chunks of chunk_size and distributed across workers
+    processes, with at most one chunk per worker in flight so only a bounded
+    number of rendered pages is held at a time. Documents that fit in a single
+    chunk, or runs with one worker, are rendered in the calling process one
+    page at a time.
+    """
+    workers = RENDER_WORKERS if workers is None else max(1, workers)
+    chunk_size = RENDER_CHUNK_SIZE if chunk_size is None else max(1, chunk_size)
+
+    start = time.perf_counter() if timings is not None else 0.0
+    with open_pdf(pdf) as doc:
+        if timings is not None:
+            timings.add("parse", time.perf_counter() - start)
+        indices = list(range(doc.page_count)) if pages is None else list(pages)
+        if workers == 1 or len(indices) <= chunk_size:
+            for i in indices:
+                yield render_page_set(doc[i], profile, codec, timings)
+            return
+
+    temporary = not isinstance(pdf, str)
+    if temporary:
+        fd, path = tempfile.mkstemp(prefix="flipbook-", suffix=".pdf")
+    else:
+        path = pdf
+    in_flight: Deque[Future] = deque()
+    try:
+        if temporary:
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf)
+
+        token = uuid.uuid4().hex
+        pool = _get_pool(workers)
+        starts = iter(range(0, len(indices), chunk_size))
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                chunk_indices = indices[start:start + chunk_size]
+                in_flight.append(
+                    pool.submit(_render_chunk, path, token, chunk_indices, profile, codec, timings is not None)
+                )
+
+        for _ in range(workers):
+            submit_next()
+        while in_flight:
+            chunk, worker_stages = in_flight.popleft().result()
+            submit_next()
+            if worker_stages:
+                timings.merge(worker_stages)
+            yield from chunk
+    finally:
+        for future in in_flight:
+            future.cancel()
+        if temporary:
+            os.unlink(path)
+
+
+def iter_pdf_pages(
+    pdf: Union[bytes, str],
+    target_width: int = 900,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    codec: ImageCodec = ImageCodec(),
+) -> Iterator[bytes]:
+    """Yield encoded image bytes for every page of a PDF at one width, in page order"""
+    profile = RenderProfile((target_width,))
+    for images in iter_pdf_page_sets(pdf, profile, workers=workers, chunk_size=chunk_size, codec=codec):
+        yield images[0]
+
+
+def render_pdf_pages(
+    pdf: Union[bytes, str],
+    target_width: int = 900,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    codec: ImageCodec = ImageCodec(),
+) -> List[bytes]:
+    """Render every page of a PDF to image bytes, in page order (see iter_pdf_pages)"""
+    return list(iter_pdf_pages(pdf, target_width, workers=workers, chunk_size=chunk_size, codec=codec))
@@ -6,7 +6,18 @@ Copy and modify these examples for your specific needs.
 """
 
 from datetime import datetime
-from database import create_document, get_documents, update_document, delete_document
+from typing import Iterable, Iterator
+from database import (
+    create_document,
+    create_documents,
+    find_document,
+    iter_documents,
+    update_document,
+    delete_document,
+)
+
+# The indexes these helpers rely on are declared in schemas.py (COLLECTION_INDEXES)
+# and created at startup.
 
 # =============================================================================
 # USER MANAGEMENT SCHEMA
@@ -33,8 +44,7 @@ def create_user(name: str, email: str, password_hash: str):
 
 def get_user_by_email(email: str):
     """Get user by email"""
-    users = get_documents("users", {"email": email})
-    return users[0] if users else None
+    return find_document("users", {"email": email})
 
 # =============================================================================
 # BLOG/CMS SCHEMA
@@ -68,25 +78,26 @@ def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
     }
     
     # Add comment to post's comments array
-    from database import db
+    from database import db, query_cache
     result = db.posts.update_one(
         {"_id": ObjectId(post_id)},
         {"$push": {"comments": comment}}
     )
+    # Writes through db directly bypass the helpers, so drop cached reads of posts here
+    query_cache.invalidate("posts")
     return result.modified_count > 0
 
 # =============================================================================
 # E-COMMERCE SCHEMA
 # =============================================================================
 
-def create_product(name: str, price: float, description: str, category: str):
-    """Create a product"""
-    product_data = {
+def _product_data(name: str, price: float, description: str, category: str, sku: str):
+    return {
         "name": name,
         "price": price,
         "description": description,
         "category": category,
-        "sku": f"PROD-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "sku": sku,
         "inventory": {
             "stock": 0,
             "reserved": 0,
@@ -100,15 +111,35 @@ def create_product(name: str, price: float, description: str, category: str):
             "count": 0
         }
     }
+
+def create_product(name: str, price: float, description: str, category: str):
+    """Create a product"""
+    product_data = _product_data(name, price, description, category, f"PROD-{datetime.now().strftime('%Y%m%d%H%M%S')}")
     return create_document("products", product_data)
 
-def create_order(user_id: str, items: list, shipping_address: dict):
-    """Create an order"""
+def create_products(products: Iterable[dict], ordered: bool = False):
+    """Create many products in batched inserts.
+
+    Each item has the create_product arguments as keys (name, price,
+    description, category). SKUs share one timestamp and get a sequence
+    suffix, since a whole batch is created within the same second.
+    """
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    return create_documents("products", (
+        _product_data(p["name"], p["price"], p["description"], p["category"], f"PROD-{stamp}-{seq:06d}")
+        for seq, p in enumerate(products)
+    ), ordered=ordered)
+
+def iter_products(category: str = None, batch_size: int = 500) -> Iterator[dict]:
+    """Stream products (optionally of one category) without loading them all"""
+    return iter_documents("products", {"category": category} if category else None, batch_size=batch_size)
+
+def _order_data(user_id: str, items: list, shipping_address: dict, order_number: str):
     total_amount = sum(item["price"] * item["quantity"] for item in items)
-    
-    order_data = {
+
+    return {
         "user_id": user_id,
-        "order_number": f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "order_number": order_number,
         "items": items,
         "total_amount": total_amount,
         "shipping_address": shipping_address,
@@ -124,8 +155,29 @@ def create_order(user_id: str, items: list, shipping_address: dict):
             "status": "processing"
         }
     }
+
+def create_order(user_id: str, items: list, shipping_address: dict):
+    """Create an order"""
+    order_data = _order_data(user_id, items, shipping_address, f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}")
     return create_document("orders", order_data)
 
+def create_orders(orders: Iterable[dict], ordered: bool = False):
+    """Create many orders in batched inserts.
+
+    Each item has the create_order arguments as keys (user_id, items,
+    shipping_address). Order numbers share one timestamp and get a sequence
+    suffix.
+    """
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    return create_documents("orders", (
+        _order_data(o["user_id"], o["items"], o["shipping_address"], f"ORD-{stamp}-{seq:06d}")
+        for seq, o in enumerate(orders)
+    ), ordered=ordered)
+
+def iter_user_orders(user_id: str, batch_size: int = 500) -> Iterator[dict]:
+    """Stream a user's orders, oldest first, without loading them all"""
+    return iter_documents("orders", {"user_id": user_id}, batch_size=batch_size)
+
 # =============================================================================
 # TASK/PROJECT MANAGEMENT SCHEMA
 # =============================================================================
@@ -319,6 +371,9 @@ if __name__ == "__main__":
     # Create a product
     # product_id = create_product("iPhone 15", 999.99, "Latest iPhone", "Electronics")
     
+    # Load a catalogue in batches
+    # create_products({"name": f"Item {i}", "price": 9.99, "description": "", "category": "Misc"} for i in range(10000))
+
     # Track user activity
     # track_user_activity(user_id, "create", "post", post_id, {"category": "blog"})
     
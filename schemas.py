@@ -9,10 +9,20 @@ Model name is converted to lowercase for the collection name:
 - User -> "user" collection
 - Product -> "product" collection
 - BlogPost -> "blogs" collection
+Set `__collection__` on a model to use another collection name.
+
+Indexes are declared here and created when the app starts (see
+database.ensure_schema_indexes): on a model in `__indexes__`, or in
+COLLECTION_INDEXES for collections used without a model. Declare one for
+every field you look documents up or filter by, so those queries stay index
+lookups as the collection grows; compound keys serve queries on any leading
+prefix of them.
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import ClassVar, Dict, List, Optional
+
+from database import Index
 
 # Example schemas (replace with your own):
 
@@ -21,6 +31,8 @@ class User(BaseModel):
     Users collection schema
     Collection name: "user" (lowercase of class name)
     """
+    __indexes__: ClassVar[List[Index]] = [Index(("email",), unique=True)]
+
     name: str = Field(..., description="Full name")
     email: str = Field(..., description="Email address")
     address: str = Field(..., description="Address")
@@ -32,6 +44,9 @@ class Product(BaseModel):
     Products collection schema
     Collection name: "product" (lowercase of class name)
     """
+    # Listings by category, optionally only what is in stock
+    __indexes__: ClassVar[List[Index]] = [Index(("category", "in_stock"))]
+
     title: str = Field(..., description="Product title")
     description: Optional[str] = Field(None, description="Product description")
     price: float = Field(..., ge=0, description="Price in dollars")
@@ -41,6 +56,19 @@ class Product(BaseModel):
 # Add your own schemas here:
 # --------------------------------------------------
 
+# Indexes of collections used without a model above: those of schema_examples.py.
+# Its keyset-paginated readers (iter_documents) sort on _id, so their filter
+# fields are indexed together with _id.
+COLLECTION_INDEXES: Dict[str, List[Index]] = {
+    "users": [Index(("email",), unique=True)],
+    "posts": [Index(("slug",)), Index(("author_id",))],
+    "products": [Index(("category", "_id"))],
+    "orders": [Index(("user_id", "_id"))],
+    "tasks": [Index(("project_id",))],
+    "messages": [Index(("room_id",))],
+    "notifications": [Index(("user_id", "is_read"))],
+}
+
 # Note: The Flames database viewer will automatically:
 # 1. Read these schemas from GET /schema endpoint
 # 2. Use them for document validation when creating/editing
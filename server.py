@@ -0,0 +1,255 @@
+"""
+Production Server
+
+Runs the app on several uvicorn worker processes that share one listening
+socket, instead of `uvicorn main:app --reload` (one process on one core, plus
+a file watcher). Use `uvicorn main:app --reload` for development only.
+
+- Workers start in STARTUP_MODE=warm unless it is set, so a worker only takes
+  connections once PyMuPDF, its render processes and the database pool are up.
+- A worker is recycled after WORKER_MAX_REQUESTS requests (plus a random
+  jitter so workers do not all restart together), or when it and its render
+  processes use more than WORKER_MAX_RSS_MB. This contains PyMuPDF memory
+  growth. A recycled worker stops accepting connections, finishes what it
+  has in flight and exits. Its replacement is started at once, so capacity
+  does not drop.
+- SIGTERM / SIGINT drain every worker the same way. Streamed conversions get
+  GRACEFUL_TIMEOUT seconds to finish, then running background jobs get as
+  long again (JOB_DRAIN_SECONDS) before they are cancelled.
+
+Each worker limits its own concurrent conversions (CONVERT_CONCURRENCY and
+CONVERT_QUEUE_DEPTH, see conversion_executor.py). Unless RENDER_WORKERS is
+set, each renders with CPU count / WEB_WORKERS processes, so together the
+workers do not oversubscribe the cores.
+
+Workers share the cache directories on disk (see conversion_cache.py for how
+they share its budget) and the job store: MongoDB when configured, otherwise
+JOB_DIR, so a job's status can be requested from any worker.
+
+Configure with environment variables:
+- HOST / PORT: address to listen on (default: 0.0.0.0:8000)
+- WEB_WORKERS: worker processes (default: CPU count)
+- WORKER_MAX_REQUESTS: requests a worker serves before it is recycled, 0 for
+  no limit (default: 1000)
+- WORKER_MAX_REQUESTS_JITTER: up to this many extra requests, chosen per
+  worker (default: 100)
+- WORKER_MAX_RSS_MB: resident memory of a worker plus its render processes
+  above which it is recycled, 0 for no limit (default: 2048)
+- WORKER_MAX_CONNECTIONS: concurrent connections per worker before new ones
+  are answered 503, 0 for no limit (default: 0)
+- GRACEFUL_TIMEOUT: seconds in-flight requests get to finish when a worker
+  stops (default: 60)
+
+Usage:
+    python server.py    (or python main.py)
+"""
+
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", os.cpu_count() or 1)))
+WORKER_MAX_REQUESTS = max(0, int(os.getenv("WORKER_MAX_REQUESTS", 1000)))
+WORKER_MAX_REQUESTS_JITTER = max(0, int(os.getenv("WORKER_MAX_REQUESTS_JITTER", 100)))
+WORKER_MAX_RSS_MB = max(0, int(os.getenv("WORKER_MAX_RSS_MB", 2048)))
+WORKER_MAX_CONNECTIONS = max(0, int(os.getenv("WORKER_MAX_CONNECTIONS", 0)))
+GRACEFUL_TIMEOUT = max(1, int(os.getenv("GRACEFUL_TIMEOUT", 60)))
+
+# Seconds between worker health (exit and memory) checks
+CHECK_INTERVAL = 1.0
+# A worker failing within this many seconds of starting is a boot failure: stop rather than respawn it forever
+BOOT_FAILURE_SECONDS = 5.0
+
+logger = logging.getLogger("uvicorn.error")
+
+# Workers are fresh interpreters that receive the listening socket from this process
+multiprocessing.allow_connection_pickling()
+_spawn = multiprocessing.get_context("spawn")
+
+
+def _rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _children(pid: int) -> List[int]:
+    # Each thread lists the children it started; render processes are started from worker threads
+    children = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return children
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def worker_rss(pid: int) -> Optional[int]:
+    """Resident bytes of a worker and its child processes (render workers), None where /proc is unavailable"""
+    try:
+        total = _rss_bytes(pid)
+    except OSError:
+        return None
+    for child in _children(pid):
+        try:
+            total += _rss_bytes(child)
+        except OSError:
+            pass
+    return total
+
+
+def _serve(config: uvicorn.Config, sockets: list):
+    """Worker process: serve the app on the sockets the supervisor bound"""
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    """Starts, recycles and stops the worker processes"""
+
+    def __init__(
+        self,
+        app: str = "main:app",
+        host: str = HOST,
+        port: int = PORT,
+        workers: int = WEB_WORKERS,
+        max_requests: int = WORKER_MAX_REQUESTS,
+        max_requests_jitter: int = WORKER_MAX_REQUESTS_JITTER,
+        max_rss_mb: int = WORKER_MAX_RSS_MB,
+        max_connections: int = WORKER_MAX_CONNECTIONS,
+        graceful_timeout: int = GRACEFUL_TIMEOUT,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss_mb * 1024 ** 2
+        self.max_connections = max_connections
+        self.graceful_timeout = graceful_timeout
+        # A worker drains connections, then background jobs, then stops its pools
+        self.stop_timeout = 2 * graceful_timeout + 10
+        self.recycled = 0
+        # pid -> (process, start time)
+        self._processes: Dict[int, Tuple[object, float]] = {}
+        # Workers told to stop, with the time after which they are killed
+        self._draining: List[Tuple[object, float]] = []
+        self._sockets = []
+        self._should_exit = threading.Event()
+
+    def _config(self) -> uvicorn.Config:
+        max_requests = None
+        if self.max_requests:
+            max_requests = self.max_requests + random.randint(0, self.max_requests_jitter)
+        return uvicorn.Config(
+            self.app,
+            host=self.host,
+            port=self.port,
+            limit_max_requests=max_requests,
+            limit_concurrency=self.max_connections or None,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+
+    def _spawn(self):
+        config = self._config()
+        process = _spawn.Process(target=_serve, args=(config, self._sockets), name="flipbook-worker")
+        process.start()
+        self._processes[process.pid] = (process, time.monotonic())
+
+    def _drain(self, process, reason: str):
+        """Ask a worker to finish its in-flight work and exit (SIGTERM), killing it if it takes too long"""
+        logger.info("Recycling worker [%s]: %s", process.pid, reason)
+        process.terminate()
+        self._draining.append((process, time.monotonic() + self.stop_timeout))
+
+    def _check(self):
+        for pid, (process, started) in list(self._processes.items()):
+            if not process.is_alive():
+                del self._processes[pid]
+                if process.exitcode == 0:
+                    logger.info("Worker [%s] exited (request limit reached), starting a new one", pid)
+                elif time.monotonic() - started < BOOT_FAILURE_SECONDS:
+                    logger.error("Worker [%s] failed to boot (exit code %s), stopping", pid, process.exitcode)
+                    self._should_exit.set()
+                    return
+                else:
+                    logger.warning("Worker [%s] exited with code %s, starting a new one", pid, process.exitcode)
+                self.recycled += 1
+                self._spawn()
+            elif self.max_rss:
+                rss = worker_rss(pid)
+                if rss is not None and rss > self.max_rss:
+                    del self._processes[pid]
+                    self._drain(process, f"{rss / 1024 ** 2:.0f} MB resident, limit {self.max_rss / 1024 ** 2:.0f} MB")
+                    self.recycled += 1
+                    self._spawn()
+        now = time.monotonic()
+        for process, deadline in list(self._draining):
+            if not process.is_alive():
+                process.join()
+                self._draining.remove((process, deadline))
+            elif now > deadline:
+                logger.warning("Worker [%s] did not finish draining in time, killing it", process.pid)
+                process.kill()
+
+    def handle_exit(self, sig, frame):
+        self._should_exit.set()
+
+    def run(self):
+        # Workers inherit these; each sizes its own pools from them
+        os.environ.setdefault("STARTUP_MODE", "warm")
+        os.environ.setdefault("RENDER_WORKERS", str(max(1, (os.cpu_count() or 1) // self.workers)))
+        os.environ.setdefault("JOB_DRAIN_SECONDS", str(self.graceful_timeout))
+
+        self._sockets = [self._config().bind_socket()]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_exit)
+        logger.info("Started supervisor [%s] with %s workers", os.getpid(), self.workers)
+        for _ in range(self.workers):
+            self._spawn()
+        try:
+            while not self._should_exit.wait(CHECK_INTERVAL):
+                self._check()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Drain every worker, then stop; workers still running after stop_timeout are killed"""
+        logger.info("Shutting down: draining %s workers", len(self._processes) + len(self._draining))
+        deadline = time.monotonic() + self.stop_timeout
+        processes = [process for process, _ in self._processes.values()] + [process for process, _ in self._draining]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker [%s] did not finish draining in time, killing it", process.pid)
+                process.kill()
+                process.join()
+        self._processes.clear()
+        self._draining.clear()
+        for sock in self._sockets:
+            sock.close()
+
+
+def run():
+    Supervisor().run()
+
+
+if __name__ == "__main__":
+    run()
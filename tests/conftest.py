@@ -0,0 +1,55 @@
+"""Shared fixtures: every cache and job directory points at a fresh temporary directory"""
+
+import os
+import tempfile
+
+import pytest
+
+_ROOT = tempfile.mkdtemp(prefix="flipbook-tests-")
+os.environ["CONVERSION_CACHE_DIR"] = os.path.join(_ROOT, "cache")
+os.environ["ASSET_STORE_DIR"] = os.path.join(_ROOT, "assets")
+os.environ["JOB_DIR"] = os.path.join(_ROOT, "jobs")
+os.environ.setdefault("RENDER_WORKERS", "1")
+os.environ.pop("DATABASE_URL", None)
+
+
+def alpha_pdf(*alphas: float, nested: bool = False) -> bytes:
+    """One page per alpha, each filling itself red with the same content stream.
+
+    The pages differ only in the fill alpha of the ExtGState their resources
+    name GS1; with nested, the fill is drawn by a form XObject whose own
+    resources hold the ExtGState.
+    """
+    import fitz
+
+    doc = fitz.open()
+    for alpha in alphas:
+        page = doc.new_page(width=200, height=200)
+        gs = doc.get_new_xref()
+        doc.update_object(gs, f"<</Type/ExtGState/ca {alpha}>>")
+        contents = doc.get_new_xref()
+        doc.update_object(contents, "<<>>")
+        if nested:
+            form = doc.get_new_xref()
+            doc.update_object(
+                form, f"<</Type/XObject/Subtype/Form/BBox[0 0 200 200]/Resources<</ExtGState<</GS1 {gs} 0 R>>>>>>"
+            )
+            doc.update_stream(form, b"/GS1 gs 1 0 0 rg 0 0 200 200 re f")
+            doc.update_stream(contents, b"/Fm1 Do")
+            resources = f"<</XObject<</Fm1 {form} 0 R>>>>"
+        else:
+            doc.update_stream(contents, b"/GS1 gs 1 0 0 rg 0 0 200 200 re f")
+            resources = f"<</ExtGState<</GS1 {gs} 0 R>>>>"
+        doc.xref_set_key(page.xref, "Contents", f"{contents} 0 R")
+        doc.xref_set_key(page.xref, "Resources", resources)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _stop_render_pool():
+    yield
+    from renderer import shutdown_render_pool
+
+    shutdown_render_pool()
@@ -0,0 +1,54 @@
+import fitz
+
+import main
+from renderer import RenderProfile, document_info
+from uploads import PdfSource
+
+from .conftest import alpha_pdf
+
+
+def _fingerprints(pdf: bytes):
+    return [page["fingerprint"] for page in document_info(pdf)["pages"]]
+
+
+def test_identical_pages_share_a_fingerprint():
+    first, second = _fingerprints(alpha_pdf(0.5, 0.5))
+    assert first == second
+
+
+def test_fingerprint_covers_graphics_state():
+    first, second = _fingerprints(alpha_pdf(0.5, 0.05))
+    assert first != second
+
+
+def test_fingerprint_covers_form_xobject_resources():
+    first, second = _fingerprints(alpha_pdf(0.5, 0.05, nested=True))
+    assert first != second
+
+
+def test_fingerprint_survives_renumbering():
+    pdf = alpha_pdf(0.5, 0.05, nested=True)
+    with fitz.open(stream=pdf) as doc:
+        rewritten = doc.tobytes(garbage=4)
+    assert _fingerprints(rewritten) == _fingerprints(pdf)
+
+
+def _render(pdf: bytes, dedup: main.DedupStats):
+    source = PdfSource.from_bytes(pdf)
+    profile = RenderProfile((100,))
+    conversion_id = main._conversion_id(source, profile, main.ImageCodec())
+    return list(main._render_page_sets(source, conversion_id, profile, main.ImageCodec(), dedup=dedup))
+
+
+def test_pages_differing_only_in_resources_are_not_deduplicated():
+    dedup = main.DedupStats()
+    first, second = _render(alpha_pdf(0.5, 0.05), dedup)
+    assert dedup.renders == 0
+    assert first != second
+
+
+def test_identical_pages_are_deduplicated():
+    dedup = main.DedupStats()
+    first, second = _render(alpha_pdf(0.5, 0.5), dedup)
+    assert dedup.renders == 1
+    assert first == second
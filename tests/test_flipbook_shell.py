@@ -0,0 +1,19 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.mark.parametrize(
+    "raw", ['{"width":"abc"}', '{"height":true}', '{"gradients":1}', '{"display":"x"}', '{"elevation":0}']
+)
+def test_turn_options_of_the_wrong_type_are_rejected(raw):
+    with pytest.raises(HTTPException) as e:
+        main._parse_turn_options(raw)
+    assert e.value.status_code == 400
+
+
+def test_inlined_values_cannot_close_the_script():
+    tail = main._flipbook_tail("</script><script>alert(1)//", {"display": "double"})
+    assert tail.count(b"</script>") == tail.count(b"<script>")
+    assert b"\\u003c/script>\\u003cscript>alert(1)//" in tail
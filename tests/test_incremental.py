@@ -0,0 +1,51 @@
+import main
+from conversion_cache import ConversionCache
+from renderer import RenderProfile, iter_pdf_page_sets
+from uploads import PdfSource
+
+from .conftest import alpha_pdf
+
+PROFILE = RenderProfile((100,))
+CODEC = main.ImageCodec()
+
+
+def _convert(pdf: bytes, previous: str = None):
+    """(conversion ID, page images) of a conversion of pdf, incremental against previous"""
+    source = PdfSource.from_bytes(pdf)
+    pages = list(main._iter_pdf_to_page_sets(source, PROFILE, CODEC, previous=previous))
+    return main._conversion_id(source, PROFILE, CODEC), pages
+
+
+def _record_renders(monkeypatch) -> list:
+    rendered = []
+    original = main.iter_pdf_page_sets
+
+    def recording(pdf, profile, *args, pages=None, **kwargs):
+        rendered.extend(pages or [])
+        return original(pdf, profile, *args, pages=pages, **kwargs)
+
+    monkeypatch.setattr(main, "iter_pdf_page_sets", recording)
+    return rendered
+
+
+def test_page_with_changed_resources_is_rendered_again(monkeypatch):
+    previous, old_pages = _convert(alpha_pdf(0.5, 0.3))
+    rendered = _record_renders(monkeypatch)
+    _, new_pages = _convert(alpha_pdf(0.5, 0.05), previous=previous)
+
+    assert rendered == [1]
+    assert new_pages[0] == old_pages[0]
+    assert new_pages[1] != old_pages[1]
+    assert new_pages == list(iter_pdf_page_sets(alpha_pdf(0.5, 0.05), PROFILE, workers=1, codec=CODEC))
+
+
+def test_incremental_conversion_without_page_cache(monkeypatch):
+    monkeypatch.setattr(main, "conversion_cache", ConversionCache(max_bytes=0))
+    monkeypatch.setattr(main, "payload_cache", ConversionCache(max_bytes=0))
+    previous, _ = _convert(alpha_pdf(0.5, 0.2))
+    rendered = _record_renders(monkeypatch)
+    _, pages = _convert(alpha_pdf(0.5, 0.1), previous=previous)
+
+    # The manifest is still there; with no stored images, every page is rendered
+    assert len(pages) == 2
+    assert sorted(rendered) == [0, 1]
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from jobs import CANCELLED, FileJobStore, JobManager
+
+
+def _manager(tmp_path, runner) -> JobManager:
+    return JobManager(runner, store=FileJobStore(str(tmp_path)), workers=1, job_dir=str(tmp_path))
+
+
+def _wait_until_running(manager: JobManager, job_id: str):
+    deadline = time.monotonic() + 5
+    while manager.get(job_id)["status"] != "running" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_shutdown_records_running_jobs_as_cancelled(tmp_path):
+    def runner(output_file, report_progress):
+        for page in range(1000):
+            time.sleep(0.01)
+            report_progress(page, 1000)
+
+    manager = _manager(tmp_path, runner)
+    job_id = manager.submit("slow.pdf")
+    _wait_until_running(manager, job_id)
+    manager.shutdown(wait=False, drain_timeout=0.05)
+
+    assert manager.get(job_id)["status"] == CANCELLED
+
+
+def test_job_failing_after_cancellation_is_cancelled(tmp_path):
+    pool_closed = threading.Event()
+
+    def runner(output_file, report_progress):
+        report_progress(0, 2)
+        pool_closed.wait(5)
+        raise RuntimeError("render pool shut down")
+
+    manager = _manager(tmp_path, runner)
+    job_id = manager.submit("doc.pdf")
+    _wait_until_running(manager, job_id)
+    threading.Timer(0.1, pool_closed.set).start()
+    manager.shutdown(wait=False, drain_timeout=0)
+
+    assert manager.get(job_id)["status"] == CANCELLED
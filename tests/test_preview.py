@@ -0,0 +1,21 @@
+import main
+import renderer
+from renderer import RenderProfile
+from uploads import PdfSource
+
+from .conftest import alpha_pdf
+
+
+def test_preview_does_not_fingerprint_pages(monkeypatch):
+    def fingerprint(*args):
+        raise AssertionError("previews only need page sizes")
+
+    monkeypatch.setattr(renderer, "page_fingerprint", fingerprint)
+    source = PdfSource.from_bytes(alpha_pdf(0.5, 0.3, 0.1))
+    preview, rest = main._build_preview(source, RenderProfile((100,)), main.ImageCodec(), budget=60)
+
+    assert rest is None
+    assert preview["page_count"] == 3
+    assert preview["thumbnails_complete"]
+    preview_id = preview["thumbnails_url"].split("/")[3]
+    assert main.get_preview_thumbnails(preview_id)["thumbnails"] == preview["thumbnails"]
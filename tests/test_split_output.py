@@ -0,0 +1,19 @@
+import main
+from renderer import RenderProfile
+from uploads import PdfSource
+
+from .conftest import alpha_pdf
+
+PROFILE = RenderProfile((100,))
+CODEC = main.ImageCodec()
+
+
+def test_split_assets_are_stored_once():
+    source = PdfSource.from_bytes(alpha_pdf(0.5, 0.3, 0.1))
+    payloads = list(main._iter_asset_payloads(source, PROFILE, CODEC, "http://testserver/"))
+    conversion_id = main._conversion_id(source, PROFILE, CODEC)
+
+    assert len(payloads) == 3
+    assert main.asset_store.count(conversion_id) == 3
+    assert main.conversion_cache.count(conversion_id) is None
+    assert main.asset_store.path(conversion_id, 2, CODEC.fmt)
@@ -0,0 +1,274 @@
+"""
+PDF Upload Ingestion
+
+Reads multipart PDF uploads straight off the request stream instead of
+buffering the whole body. The file part is hashed as it arrives and kept in
+memory only while it is small; past UPLOAD_MEMORY_MAX_BYTES it is spooled to
+a temporary file, and PyMuPDF (and the render workers) open the document from
+that file's path. Memory per upload is therefore bounded by one chunk plus the
+in-memory threshold, whatever the PDF size.
+
+Bad uploads are rejected as soon as that is known, before the rest of the
+body is read: a Content-Length or running byte count above MAX_UPLOAD_BYTES,
+or a file part that has no %PDF header in its first bytes.
+
+Configure with environment variables:
+- MAX_UPLOAD_BYTES: largest accepted upload body in bytes (default: 200 MiB)
+- UPLOAD_MEMORY_MAX_BYTES: uploads up to this size stay in memory (default: 4 MiB)
+- UPLOAD_DIR: directory for spooled uploads (default: system temp dir)
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Dict, NamedTuple, Optional, Union
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 200 * 1024 ** 2))
+UPLOAD_MEMORY_MAX_BYTES = int(os.getenv("UPLOAD_MEMORY_MAX_BYTES", 4 * 1024 ** 2))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None
+
+PDF_HEADER = b"%PDF-"
+# Readers accept the header anywhere in the first 1 KiB of the file
+PDF_HEADER_WINDOW = 1024
+# Size limit for each plain (non-file) form field
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PdfSource:
+    """A PDF document held in memory or spooled to a temporary file.
+
+    renderer functions accept `document` directly: the bytes, or the path of
+    the spooled file. The temporary file is deleted by close(), or when the
+    source is garbage collected.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, spool=None, sha256: Optional[str] = None, size: int = 0):
+        self.data = data
+        self._spool = spool
+        self._sha256 = sha256
+        self.size = len(data) if data is not None else size
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PdfSource":
+        return cls(data=data)
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._spool.name if self._spool is not None else None
+
+    @property
+    def document(self) -> Union[bytes, str]:
+        """What renderer functions and fitz.open take: the PDF bytes or file path"""
+        return self.data if self.data is not None else self.path
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    def open(self):
+        """Open the document with PyMuPDF, from the file path when spooled"""
+        import fitz  # PyMuPDF
+
+        if self.data is not None:
+            return fitz.open(stream=self.data, filetype="pdf")
+        return fitz.open(self.path, filetype="pdf")
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+
+
+def as_pdf_source(pdf: Union[bytes, PdfSource]) -> PdfSource:
+    return pdf if isinstance(pdf, PdfSource) else PdfSource.from_bytes(pdf)
+
+
+class _Spool:
+    """Accumulates the file part, moving it from memory to a temp file past the threshold"""
+
+    def __init__(self, memory_max_bytes: int, directory: Optional[str]):
+        self.memory_max_bytes = memory_max_bytes
+        self.directory = directory
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        if self._file is None and self.size > self.memory_max_bytes:
+            self._file = tempfile.NamedTemporaryFile(prefix="flipbook-upload-", suffix=".pdf", dir=self.directory)
+            self._file.write(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def finish(self) -> PdfSource:
+        if self._file is None:
+            return PdfSource(data=bytes(self._buffer), sha256=self._hash.hexdigest())
+        self._file.flush()
+        return PdfSource(spool=self._file, sha256=self._hash.hexdigest(), size=self.size)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class PdfUpload(NamedTuple):
+    """A received upload: the PDF, its client-side filename and the other form fields"""
+
+    source: PdfSource
+    filename: str
+    fields: Dict[str, str]
+
+
+class _MultipartIngest:
+    """python-multipart callbacks that route the file part to a _Spool and collect the fields"""
+
+    def __init__(self, file_field: str, memory_max_bytes: int, directory: Optional[str]):
+        self.file_field = file_field
+        self.memory_max_bytes = memory_max_bytes
+        self.directory = directory
+        self.fields: Dict[str, str] = {}
+        self.spool: Optional[_Spool] = None
+        self.filename = ""
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = ""
+        self._value: Optional[bytearray] = None
+        self._in_file = False
+        self._header_checked = False
+        self._head = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        from multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        self._in_file = filename is not None
+        if not self._in_file:
+            self._value = bytearray()
+            return
+        if self._name != self.file_field:
+            raise UploadRejected(400, f"Unexpected file field '{self._name}'.")
+        if self.spool is not None:
+            raise UploadRejected(400, "Upload one PDF file per request.")
+        self.filename = filename.decode("utf-8", errors="replace")
+        self.spool = _Spool(self.memory_max_bytes, self.directory)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if not self._in_file:
+            self._value += chunk
+            if len(self._value) > MAX_FIELD_BYTES:
+                raise UploadRejected(413, f"Form field '{self._name}' is too large.")
+            return
+        if not self._header_checked:
+            self._check_header(chunk)
+        self.spool.write(chunk)
+
+    def _check_header(self, chunk: bytes):
+        """Reject non-PDFs from their first bytes, without waiting for the rest"""
+        self._head += chunk[:PDF_HEADER_WINDOW]
+        if PDF_HEADER in self._head:
+            self._header_checked = True
+        elif len(self._head) >= PDF_HEADER_WINDOW:
+            raise UploadRejected(400, "The uploaded file is not a PDF (missing %PDF header).")
+
+    def on_part_end(self):
+        if self._in_file:
+            if not self._header_checked:
+                raise UploadRejected(400, "The uploaded file is not a PDF (missing %PDF header).")
+            self._in_file = False
+        else:
+            self.fields[self._name] = self._value.decode("utf-8", errors="replace")
+            self._value = None
+
+
+async def receive_pdf_upload(
+    request,
+    file_field: str = "pdf",
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    memory_max_bytes: int = UPLOAD_MEMORY_MAX_BYTES,
+    directory: Optional[str] = UPLOAD_DIR,
+) -> PdfUpload:
+    """Stream a multipart/form-data request body into a PdfUpload.
+
+    request is a Starlette Request whose body has not been read. Raises
+    UploadRejected (413 for size, 400 otherwise) as soon as the upload is
+    known to be unacceptable.
+    """
+    from multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejected(400, "Send the PDF as multipart/form-data.")
+    too_large = UploadRejected(413, f"Upload exceeds the {max_bytes} byte limit.")
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        declared = 0
+    if declared > max_bytes:
+        raise too_large
+
+    ingest = _MultipartIngest(file_field, memory_max_bytes, directory)
+    parser = MultipartParser(boundary, ingest.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise too_large
+            parser.write(chunk)
+        parser.finalize()
+    except UploadRejected:
+        if ingest.spool is not None:
+            ingest.spool.discard()
+        raise
+    except Exception as e:
+        if ingest.spool is not None:
+            ingest.spool.discard()
+        raise UploadRejected(400, f"Malformed upload: {e}")
+    if ingest.spool is None:
+        raise UploadRejected(400, f"No PDF file in the upload (expected form field '{file_field}').")
+    return PdfUpload(ingest.spool.finish(), ingest.filename, ingest.fields)